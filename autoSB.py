@@ -18,27 +18,49 @@ import json
 import pickle
 from datetime import datetime
 import time
+import threading
+import struct
+import csv
 import io
 import re
+import copy
+import contextlib
+import asyncio
+import functools
+import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import multiprocessing
+try:
+    import numpy as np # optional; used to compute extents over many pages at once
+except ImportError:
+    np = None
 
 __all__ = ['splitall', 'splitall2', 'remove_files', 'trunc', 'replace_in_file',
-           'get_title_from_data', 'get_root_flexibly', 'add_element_to_xml', 'fix_attrdomv_error',
-           'remove_xml_element', 'replace_element_in_xml', 'map_newvals2xml',
-           'find_and_replace_text', 'find_and_replace_from_dict',
+           'get_title_from_data', 'get_bbox_from_xml', 'get_root_flexibly', 'add_element_to_xml', 'fix_attrdomv_error',
+           'remove_xml_element', 'replace_element_in_xml', 'map_newvals2xml', 'map_pagevals2xml', 'TransformPlan',
+           'find_and_replace_text', 'find_and_replace_from_dict', 'find_and_replace_in_string',
            'update_xml_tagtext', 'flip_dict', 'update_xml', 'update_all_xmls', 'json_from_xml',
-           'get_fields_from_xml', 'log_in', 'log_in2', 'flexibly_get_item',
-           'get_DOI_from_item', 'fix_falsefolder', 'rename_dirs_from_xmls', 'setup_subparents', 'inherit_SBfields', 'find_or_create_child',
+           'get_fields_from_xml', 'SbSessionManager', 'log_in', 'adopt_session', 'wrap_session', 'CachedSbSession',
+           'pool_session_connections', 'AsyncSbClient', 'prefetch_items', 'InstrumentedSbSession',
+           'ItemProxy', 'WriteBackSbSession', 'flush_writes', 'log_in2', 'flexibly_get_item',
+           'get_DOI_from_item', 'fix_falsefolder', 'rename_dirs_from_xmls', 'setup_subparents', 'plan_inheritance', 'inherit_SBfields', 'ChildTitleIndex', 'find_or_create_child', 'poll_with_backoff', 'wait_for_pages',
            'upsert_metadata', 'replace_files_by_ext', 'upload_files', 'upload_files_matching_xml',
            'upload_shp', 'find_browse_in_json', 'update_browse', 'update_all_browse_graphics', 'upload_all_updated_xmls', 'get_parent_bounds', 'get_idlist_bottomup',
-           'set_parent_extent', 'find_browse_file', 'upload_all_previewImages2', 'upload_all_previewImages', 'shp_to_new_child',
+           'bbox_corners', 'extent_fields', 'get_item_bbox', 'union_bboxes', 'aggregate_extents', 'same_bbox', 'set_parent_extent',
+           'update_extents_above', 'write_extents', 'load_extent_cache', 'save_extent_cache',
+           'read_shp_bbox', 'shp_extents', 'is_geographic_bbox', 'shp_bbox_for_xml', 'check_xml_extents',
+           'extents_from_xmls', 'set_extent_from_xmls', 'find_browse_file', 'upload_all_previewImages2', 'upload_all_previewImages', 'shp_to_new_child',
            'update_datapage', #'update_subpages_from_landing',
-           'get_pageid_from_xmlpath',
+           'PageIdResolver', 'get_pageid_from_xmlpath',
            'update_pages_from_XML_and_landing', 'remove_all_files',
            'update_existing_fields',
            'delete_all_children', 'remove_all_child_pages',
            'check_fields', 'check_fields2', 'check_fields3', 'check_fields2_topdown',
-           'landing_page_from_parentdir', 'inherit_topdown',
-           'apply_topdown', 'apply_bottomup', 'restore_original_xmls']
+           'qc_columns', 'qc_report', 'save_qc_report', 'print_qc_report',
+           'landing_page_from_parentdir', 'snapshot_fields', 'pseudo_fields', 'ReleaseSnapshot', 'inherit_topdown',
+           'apply_topdown', 'apply_bottomup', 'walk_topdown', 'walk_bottomup', 'print_tree_errors',
+           'restore_original_xmls']
 
 
 #%% Functions
@@ -112,6 +134,18 @@ def get_title_from_data(xml_file, metadata_root=False):
         print("Exception while trying to parse XML file ({}): {}".format(xml_file, e), file=sys.stderr)
         return False
 
+def get_bbox_from_xml(in_metadata):
+    # Bounding box from ./idinfo/spdom/bounding as an SB boundingBox dict, or None if it is missing or not numeric.
+    metadata_root, tree, xml_file = get_root_flexibly(in_metadata)
+    bounding = metadata_root.find('./idinfo/spdom/bounding')
+    if bounding is None:
+        return None
+    try:
+        return {'minX': float(bounding.findtext('westbc')), 'minY': float(bounding.findtext('southbc')),
+                'maxX': float(bounding.findtext('eastbc')), 'maxY': float(bounding.findtext('northbc'))}
+    except (TypeError, ValueError):
+        return None
+
 def get_root_flexibly(in_metadata):
     # Whether in_metadata is a filename or an element, get metadata_root
     # in_metadata accepts either xml file or root element of parsed metadata.
@@ -134,6 +168,15 @@ def get_root_flexibly(in_metadata):
         print("{} is not an accepted variable type for 'in_metadata'".format(in_metadata))
     return(metadata_root, tree, xml_file)
 
+def _same_element(elem1, elem2):
+    # True if two elements have the same tag, attributes, text and children, ignoring whitespace between elements.
+    if not (elem1.tag == elem2.tag and elem1.attrib == elem2.attrib and (elem1.text or '').strip() == (elem2.text or '').strip()):
+        return False
+    children1, children2 = list(elem1), list(elem2)
+    if not len(children1) == len(children2):
+        return False
+    return all((c1.tail or '').strip() == (c2.tail or '').strip() and _same_element(c1, c2) for c1, c2 in zip(children1, children2))
+
 def add_element_to_xml(in_metadata, new_elem, containertag='./idinfo'):
     # Appends element 'new_elem' to 'containertag' in XML file. in_metadata accepts either xmlfile or root element of parsed metadata. new_elem accepts either lxml._Element or XML string
     # Whether in_metadata is a filename or an element, get metadata_root
@@ -300,18 +343,7 @@ def map_newvals2xml(new_values):
         val2xml[landing_link] = {lwork_link: 1}
     # Data page URL
     if 'child_id' in new_values.keys():
-        # get URLs
-        page_url = 'https://www.sciencebase.gov/catalog/item/{}'.format(new_values['child_id']) # data_item['link']['url']
-        directdownload_link = 'https://www.sciencebase.gov/catalog/file/get/{}'.format(new_values['child_id'])
-        # add values
-        val2xml[page_url] = {citelink: 1, networkr: 0}
-        val2xml[directdownload_link] = {networkr:1}
-        access_str = 'The first link is to the page containing the data. The second is a direct link to download all data available from the page as a zip file. The final link is to the publication landing page. The data page (first link) may have additional data access options, including web services.'
-        val2xml[access_str] = {accinstr: 0}
-        # Browse graphic
-        if 'browse_file' in new_values.keys():
-            browse_link = '{}/?name={}'.format(directdownload_link, new_values['browse_file'])
-            val2xml[browse_link] = {browsen:0}
+        val2xml.update(map_pagevals2xml(new_values['child_id'], new_values.get('browse_file')))
     # Edition
     if 'edition' in new_values.keys():
         val2xml[new_values['edition']] = {edition:0}
@@ -322,6 +354,115 @@ def map_newvals2xml(new_values):
     val2xml[now_str] = {metadate: 0}
     return(val2xml)
 
+def map_pagevals2xml(child_id, browse_file=None):
+    # The part of map_newvals2xml() that depends on the data page: {new value: {XPath to element: position}}
+    citelink = './idinfo/citation/citeinfo/onlink' # Citation / Online Linkage
+    networkr = './distinfo/stdorder/digform/digtopt/onlinopt/computer/networka/networkr' # Network Resource Name
+    accinstr = './distinfo/stdorder/digform/digtopt/onlinopt/accinstr'
+    browsen = './idinfo/browse/browsen'
+    val2xml = {}
+    # get URLs
+    page_url = 'https://www.sciencebase.gov/catalog/item/{}'.format(child_id) # data_item['link']['url']
+    directdownload_link = 'https://www.sciencebase.gov/catalog/file/get/{}'.format(child_id)
+    # add values
+    val2xml[page_url] = {citelink: 1, networkr: 0}
+    val2xml[directdownload_link] = {networkr:1}
+    access_str = 'The first link is to the page containing the data. The second is a direct link to download all data available from the page as a zip file. The final link is to the publication landing page. The data page (first link) may have additional data access options, including web services.'
+    val2xml[access_str] = {accinstr: 0}
+    # Browse graphic
+    if browse_file:
+        browse_link = '{}/?name={}'.format(directdownload_link, browse_file)
+        val2xml[browse_link] = {browsen:0}
+    return(val2xml)
+
+class TransformPlan(object):
+    # The changes that update_xml() makes to every XML, prepared once per run from new_values:
+    # the element values that are the same for every XML, compiled XPaths, and the metadata_additions and
+    # metadata_replacements parsed once (each XML gets a copy). Only child_id and browse_file vary by XML.
+    # Pickled plans carry only new_values and are prepared again when unpickled (e.g. in another process).
+    # The metadata date is kept apart so that update_xml() can set it only when something else changed.
+    page_keys = ('child_id', 'browse_file')
+
+    def __init__(self, new_values):
+        self.new_values = {k: v for k, v in new_values.items() if not k in self.page_keys}
+        self._prepare()
+
+    def _prepare(self):
+        new_values = self.new_values
+        # Values before and after the data page values, in the order map_newvals2xml() adds them
+        head = map_newvals2xml({k: new_values[k] for k in ('doi', 'landing_id') if k in new_values})
+        head.popitem() # metadata date, which map_newvals2xml() adds last
+        self._head = list(head.items())
+        tail = map_newvals2xml({k: new_values[k] for k in ('edition', 'pubdate') if k in new_values})
+        self._date = [tail.popitem()] # {today: {metadata date XPath: 0}}
+        self._tail = list(tail.items())
+        self._xpaths = {}
+        self.removals = list(new_values.get('remove_fills', {}).items())
+        self.additions = [(containertag, self._parse(new_elem)) for containertag, new_elem in new_values.get('metadata_additions', {}).items()]
+        self.replacements = [(containertag, self._parse(new_elem)) for containertag, new_elem in new_values.get('metadata_replacements', {}).items()]
+        self.find_and_replace = new_values.get('find_and_replace')
+
+    def __getstate__(self):
+        return {'new_values': self.new_values}
+
+    def __setstate__(self, state):
+        self.new_values = state['new_values']
+        self._prepare()
+
+    @staticmethod
+    def _parse(new_elem):
+        if type(new_elem) is str:
+            return etree.fromstring(new_elem)
+        elif type(new_elem) is etree._Element:
+            return new_elem
+        raise TypeError("'new_elem' takes either strings or elements.")
+
+    def xpath(self, fstr):
+        if not fstr in self._xpaths:
+            self._xpaths[fstr] = etree.XPath(fstr)
+        return self._xpaths[fstr]
+
+    def tag_values(self, child_id=None, browse_file=None, set_date=True):
+        # {XPath: {index: new value}} for one XML, as flip_dict(map_newvals2xml(new_values)) would give.
+        val2xml = dict(self._head)
+        if child_id:
+            val2xml.update(map_pagevals2xml(child_id, browse_file))
+        val2xml.update(self._tail)
+        if set_date:
+            val2xml.update(self._date)
+        return flip_dict(val2xml)
+
+    def _set_values(self, metadata_root, tag_values):
+        for fstr, idx_val in tag_values.items():
+            elems = self.xpath(fstr)(metadata_root)
+            for idx in sorted(idx_val):
+                if idx < len(elems):
+                    elems[idx].text = idx_val[idx]
+                else: # the element does not yet exist
+                    update_xml_tagtext(metadata_root, idx_val[idx], fstr, idx)
+                    elems = self.xpath(fstr)(metadata_root)
+
+    def set_date(self, metadata_root):
+        # Set the metadata date to today.
+        self._set_values(metadata_root, flip_dict(dict(self._date)))
+        return metadata_root
+
+    def apply(self, metadata_root, child_id=None, browse_file=None, set_date=True):
+        # Make the changes to a parsed XML, in the same order as update_xml() always has.
+        # With set_date=False the metadata date is left as it is (see set_date()).
+        self._set_values(metadata_root, self.tag_values(child_id, browse_file, set_date))
+        for path, ftext in self.removals:
+            remove_xml_element(metadata_root, path, ftext)
+        for containertag, template in self.additions:
+            container = self.xpath(containertag)(metadata_root)[0]
+            if not any(_same_element(elem, template) for elem in container.findall(template.tag)): # added on an earlier run
+                container.append(copy.deepcopy(template))
+        for containertag, template in self.replacements:
+            new_elem = copy.deepcopy(template)
+            elem = self.xpath(containertag)(metadata_root)[0]
+            elem.replace(elem.findall(new_elem.tag)[0], new_elem)
+        return fix_attrdomv_error(metadata_root)
+
 def find_and_replace_text(fname, findstr='http:', replacestr='https:'):
     os.rename(fname, fname+'.tmp')
     with open(fname+'.tmp', 'r') as f1:
@@ -336,13 +477,17 @@ def find_and_replace_from_dict(fname, find_dict):
     ct = 0
     with io.open(fname, 'r', encoding='utf-8') as f:
         s = f.read()
-    # Iterate through find:replace pairs
-    for fstr, rstr in find_dict.items():
-        s = s.replace(fstr, rstr)
+    s = find_and_replace_in_string(s, find_dict)
     with io.open(fname, 'w', encoding='utf-8') as f:
         f.write(s)
     return(fname)
 
+def find_and_replace_in_string(s, find_dict):
+    # Iterate through find:replace pairs
+    for fstr, rstr in find_dict.items():
+        s = s.replace(fstr, rstr)
+    return(s)
+
 def update_xml_tagtext(metadata_root, newval, fstr='./distinfo', idx=0):
     # Add or update the values of each element
     try:
@@ -376,60 +521,127 @@ def flip_dict(in_dict, verbose=False):
                 out_dict[fstr][idx] = newval
     return(out_dict)
 
-def update_xml(xml_file, new_values, verbose=False):
+def update_xml(xml_file, new_values, verbose=False, extents=None, plan=None, changed=None):
     # update XML file to include new child ID and DOI
+    # If extents is a dict, the bounding box of the updated XML is added to it as {xml_file: bbox}.
+    # plan is a TransformPlan of new_values; pass the same one for every XML to prepare it only once.
+    # The file is only rewritten (and the metadata date only updated) if the other changes make a difference,
+    # so that its modified time still tells upload_all_updated_xmls() whether it needs to be uploaded.
+    # If changed is a list, xml_file is appended to it when the file is rewritten.
     #%% Map new values to their appropriate metadata elements
-    e2nv = map_newvals2xml(new_values)
-    e2nv_flipped = flip_dict(e2nv, verbose=False)
+    if plan is None:
+        plan = TransformPlan(new_values)
     #%% Update the XML with the new values
     # Save the original xml_file if an original is not already present
     if not os.path.exists(xml_file+'_orig'):
         shutil.copy(xml_file, xml_file+'_orig')
     # Parse metadata
     metadata_root, tree, xml_file = get_root_flexibly(xml_file)
-    # Update elements with new text values
-    for fstr, idx_val in e2nv_flipped.items():
-        for idx in sorted(idx_val):
-            newval = idx_val[idx]
-            # Update elements with new text value
-            update_xml_tagtext(metadata_root, newval, fstr, idx)
-    #%% Modify XML as programmed in config file.
-    if "remove_fills" in new_values:
-        [remove_xml_element(metadata_root, path, ftext) for path, ftext in new_values['remove_fills'].items()]
-    if "metadata_additions" in new_values:
-        [add_element_to_xml(metadata_root, new_elem, containertag) for containertag, new_elem in new_values['metadata_additions'].items()]
-    if "metadata_replacements" in new_values:
-        [replace_element_in_xml(metadata_root, new_elem, containertag) for containertag, new_elem in new_values['metadata_replacements'].items()]
-    #%% Fix common error in which attrdomv has multiple subelements
-    metadata_root = fix_attrdomv_error(metadata_root)
-    #%% Save changes - overwrite XML file with new XML
-    tree.write(xml_file)
-    #%% Perform find and replace the text in the file
-    if "find_and_replace" in new_values:
-        find_and_replace_from_dict(xml_file, new_values['find_and_replace'])
+    # Update elements with new text values and modify XML as programmed in config file.
+    # Also fixes common error in which attrdomv has multiple subelements
+    metadata_root = plan.apply(metadata_root, new_values.get('child_id'), new_values.get('browse_file'), set_date=False)
+    if extents is not None:
+        extents[xml_file] = get_bbox_from_xml(metadata_root)
+    #%% Serialize the XML, perform find and replace on the text, and compare to the file as it is
+    def serialize():
+        xml_str = etree.tostring(tree).decode('utf-8') # as tree.write(xml_file) would write it
+        if plan.find_and_replace:
+            xml_str = find_and_replace_in_string(xml_str, plan.find_and_replace)
+        return xml_str.encode('utf-8')
+    xml_bytes = serialize()
+    with open(xml_file, 'rb') as f:
+        if f.read() == xml_bytes:
+            return(xml_file) # already up to date; leave the file and its modified time alone
+    #%% Something changed, so update the metadata date too and overwrite the XML file once
+    plan.set_date(metadata_root)
+    xml_bytes = serialize()
+    with open(xml_file, 'wb') as f:
+        f.write(xml_bytes)
+    if changed is not None:
+        changed.append(xml_file)
     return(xml_file)
 
-def update_all_xmls(parentdir, new_values, sb=None, dict_DIRtoID=None, verbose=True):
+def update_all_xmls(parentdir, new_values, sb=None, dict_DIRtoID=None, verbose=True, extents=None, resolver=None, max_processes=1):
     # Update every XML in the directory tree with new values (from config file and SB)
     # Does not upload resulting XML to SB.
+    # If extents is a dict, it is filled with {xml_file: bbox} from the XMLs as they are updated (see extents_from_xmls()).
+    # Page IDs and browse graphics are found for all XMLs first. With max_processes > 1 the XMLs are then
+    # updated on a pool of spawned processes, which import autoSB but not the calling script (see _main_script_hidden()).
+    # XMLs that the changes make no difference to are not rewritten (see update_xml()).
+    # Returns one result per XML, in the order of the XML list: {xml_file, page_id, bbox, changed, error}.
     xmllist = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
+    plan = TransformPlan(new_values)
+    tasks = []
     for xml_file in xmllist:
-        # Update XML
         # Get SB values
-        datapageid = get_pageid_from_xmlpath(xml_file, sb, dict_DIRtoID, parentdir=parentdir, verbose=False)
-        # add SB UID to be updated in XML
-        new_values['child_id'] = datapageid
+        datapageid = get_pageid_from_xmlpath(xml_file, sb, dict_DIRtoID, parentdir=parentdir, verbose=False, resolver=resolver)
         # Look for browse graphic in directory with XML
-        datadir = os.path.dirname(xml_file)
-        browse_file = find_browse_file(datadir)
-        new_values.pop('browse_file', None) # remove value from past iteration
-        if browse_file:
-            new_values['browse_file'] = browse_file
-        # Make the changes to the XML based on the new_values dictionary
-        update_xml(xml_file, new_values, verbose=verbose) # new_values['pubdate']
+        browse_file = find_browse_file(os.path.dirname(xml_file))
+        tasks.append((xml_file, datapageid, browse_file, extents is not None))
+    # Make the changes to the XMLs
+    if max_processes > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // (max_processes * 4))
+        with _main_script_hidden(), ProcessPoolExecutor(max_processes, mp_context=multiprocessing.get_context('spawn'),
+                                                        initializer=_set_worker_plan, initargs=(plan,)) as pool:
+            results = list(pool.map(_update_xml_task, tasks, chunksize=chunksize))
+    else:
+        _set_worker_plan(plan)
+        results = [_update_xml_task(task) for task in tasks]
+    # Report in the order of the XML list
+    ct_errors = 0
+    for result in results:
+        if result['error']:
+            ct_errors += 1
+            print("EXCEPTION while updating XML {}: {}".format(result['xml_file'], result['error']))
+            continue
+        if extents is not None:
+            extents[result['xml_file']] = result['bbox']
         if verbose:
-            print("UPDATED XML: {}".format(xml_file))
-    return
+            print("{} XML: {}".format('UPDATED' if result['changed'] else 'UNCHANGED', result['xml_file']))
+    if ct_errors:
+        print("{} of {} XMLs could not be updated.".format(ct_errors, len(results)))
+    if verbose:
+        print("{} of {} XMLs changed.".format(sum(1 for result in results if result['changed']), len(results)))
+    return results
+
+_worker = threading.local()
+
+def _set_worker_plan(plan):
+    # The TransformPlan used by _update_xml_task() in this process.
+    _worker.plan = plan
+
+@contextlib.contextmanager
+def _main_script_hidden():
+    # A spawned process runs the main module again before it starts work, unless the module is guarded by
+    # if __name__ == '__main__'. sb_automation.py is a plain script, so it is hidden while the pool starts
+    # its processes; the worker (_update_xml_task) only needs autoSB.
+    main = sys.modules['__main__']
+    saved = {name: main.__dict__[name] for name in ('__file__', '__spec__') if name in main.__dict__}
+    main.__dict__.pop('__file__', None)
+    main.__spec__ = None
+    try:
+        yield
+    finally:
+        main.__dict__.pop('__spec__', None)
+        main.__dict__.update(saved)
+
+def _update_xml_task(task):
+    # Update one XML for update_all_xmls(); task is (xml_file, page ID, browse file, whether to get the bbox).
+    xml_file, page_id, browse_file, get_extent = task
+    result = {'xml_file': xml_file, 'page_id': page_id, 'bbox': None, 'changed': False, 'error': None}
+    page_values = {'child_id': page_id}
+    if browse_file:
+        page_values['browse_file'] = browse_file
+    extents = {} if get_extent else None
+    changed = []
+    try:
+        update_xml(xml_file, page_values, extents=extents, plan=_worker.plan, changed=changed)
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    result['changed'] = bool(changed)
+    if extents:
+        result['bbox'] = extents.get(xml_file)
+    return result
 
 def json_from_xml():
     #FIXME: Currently hard-wired; will need to adapted to match metadata scheme.
@@ -461,27 +673,625 @@ def get_fields_from_xml(sb, item, xml_file, sbfields, metadata_root=False):
 # SB helper functions
 #
 ###################################################
-def log_in(username=None, password=None):
-    print('Logging in if necessary...')
-    if 'sb' in globals():
-        if not sb.is_logged_in():
-            print('Logging back in...')
+class SbSessionManager(object):
+    # Keep a single live SbSession for the whole run.
+    # - Validity is checked locally from the token expiry (sciencebasepy >= 2) or, for older
+    #   sessions, with is_logged_in() at most once every check_interval seconds.
+    # - When the token is within refresh_margin seconds of expiring (the same 600 s window in which
+    #   sciencebasepy refreshes inline before a request) or has expired, it is refreshed under the lock.
+    # - A full login only happens for the first call or when the refresh fails.
+    #   The same SbSession object is logged back in so that references held elsewhere stay valid.
+    def __init__(self, check_interval=300, refresh_margin=600):
+        self.check_interval = check_interval
+        self.refresh_margin = refresh_margin
+        self.sb = None
+        self.session = None # what log_in() hands out: self.sb or a wrapper around it
+        self.username = None
+        self._password = None
+        self._last_check = 0
+        self._lock = threading.RLock()
+
+    def get(self, username=None, password=None):
+        # Return the live session, logging in only if there is none or it has expired.
+        with self._lock:
+            if username:
+                self.username = username
+            if password:
+                self._password = password
+            if self.sb is None:
+                self._login()
+            elif not self.is_valid():
+                print('Logging back in...')
+                self._login()
+            return self.session
+
+    def adopt(self, sb):
+        # Use an existing session (e.g. one created outside log_in) as the managed session.
+        with self._lock:
+            self.sb = sb
+            self.session = sb
+            self._last_check = time.time()
+        return sb
+
+    def wrap(self, wrapper_class, **kwargs):
+        # Wrap the handed-out session (e.g. CachedSbSession) so that later log_in() calls return the wrapper.
+        with self._lock:
+            if self.session is None:
+                raise RuntimeError("Log in before wrapping the ScienceBase session.")
+            self.session = wrapper_class(self.session, **kwargs)
+            return self.session
+
+    def is_valid(self):
+        # Cheap validity check; refreshes the token when it is close to expiring or has expired.
+        # False means a full login is needed.
+        with self._lock:
+            sessionex = getattr(self.sb, '_sbSessionEx', False)
+            if sessionex is None: # sciencebasepy >= 2 session that was never logged in
+                return False
+            if sessionex and hasattr(sessionex, 'refresh_token_time_remaining'):
+                try:
+                    remaining = sessionex.refresh_token_time_remaining()
+                except Exception:
+                    remaining = 0
+                if remaining < self.refresh_margin:
+                    return self._refresh()
+                return True
+            # Older sessions: is_logged_in() costs a request, so only ask periodically.
+            if time.time() - self._last_check < self.check_interval:
+                return True
+            self._last_check = time.time()
+            try:
+                return self.sb.is_logged_in()
+            except Exception:
+                return False
+
+    def _refresh(self):
+        try:
+            self.sb.refresh_token()
+            return True
+        except Exception as e:
+            print('Token refresh failed ({}).'.format(e))
+            return False
+
+    def _login(self):
+        print('Logging in...')
+        if not self.username:
+            self.username = input("SB username (should be entire USGS email): ")
+        sb = self.sb if self.sb is not None and hasattr(self.sb, 'login') else pysb.SbSession(env=None)
+        if not self._password:
+            sb = sb.loginc(self.username)
         else:
-            return sb
-    if not username:
-        username = input("SB username (should be entire USGS email): ")
-    if not password:
-        sb = pysb.SbSession(env=None).loginc(username)
-    else:
+            try:
+                sb = sb.login(self.username, self._password)
+            except Exception as e: # 'Login failed' returned as Exception for bad password in login()
+                print('{}. Try reentering...'.format(e))
+                sb = sb.loginc(self.username) # 'Invalid password, try again' printed for bad password
+        self.sb = sb
+        if self.session is None:
+            self.session = sb
+        self._last_check = time.time()
+        return sb
+
+_session_manager = SbSessionManager()
+
+def log_in(username=None, password=None):
+    # Return the run's single SbSession; only logs in when there is no live session.
+    return _session_manager.get(username, password)
+
+def adopt_session(sb):
+    # Make sb (e.g. a fakeSB.FakeSbSession) the session that log_in() returns.
+    return _session_manager.adopt(sb)
+
+def wrap_session(wrapper_class, **kwargs):
+    # Wrap the managed session; later log_in() calls return the wrapper.
+    return _session_manager.wrap(wrapper_class, **kwargs)
+
+class CachedSbSession(object):
+    # Read-through cache of item JSON in front of an SbSession (or another wrapper).
+    # - get_item() answers from memory when it can; the least recently used items are evicted past maxsize.
+    # - Items returned by create/update/upload calls replace the cached copy; other writes invalidate it.
+    #   Updates that send only some fields are applied to the cached copy.
+    # - Copies go in and out of the cache because autoSB functions modify the items they are given.
+    # All other attributes are passed through to the wrapped session.
+    def __init__(self, sb, maxsize=2000):
+        self._sb = sb
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        return getattr(self._sb, name)
+
+    def cache_stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._items), 'maxsize': self.maxsize}
+
+    def invalidate(self, itemid=None):
+        # Drop one item from the cache, or everything if no ID is given.
+        with self._lock:
+            if itemid is None:
+                self._items.clear()
+            else:
+                self._items.pop(itemid, None)
+
+    def _store(self, item):
+        if not isinstance(item, dict) or not 'id' in item:
+            return item
+        with self._lock:
+            self._items[item['id']] = copy.deepcopy(item)
+            self._items.move_to_end(item['id'])
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+        return item
+
+    def get_item(self, itemid, params=None):
+        if params: # partial JSON is not cached
+            return self._sb.get_item(itemid, params)
+        with self._lock:
+            if itemid in self._items:
+                self.hits += 1
+                self._items.move_to_end(itemid)
+                return copy.deepcopy(self._items[itemid])
+            self.misses += 1
+        return self._store(self._sb.get_item(itemid))
+
+    def create_item(self, item_json):
+        return self._store(self._sb.create_item(item_json))
+
+    def create_items(self, items_json):
+        items = self._sb.create_items(items_json)
+        for item in items or []:
+            self._store(item)
+        return items
+
+    def _pop(self, itemid):
+        with self._lock:
+            return self._items.pop(itemid, None)
+
+    def _updated(self, item_json, item, cached):
+        # Cache the result of an update. A partial update (only some fields) is applied to the
+        # copy that was cached before it, since the response may not be the whole item.
+        if 'title' in item_json:
+            return self._store(item)
+        if cached is not None:
+            cached.update(copy.deepcopy(item_json))
+            self._store({k: v for k, v in cached.items() if v is not None})
+        return item
+
+    def update_item(self, item_json):
+        cached = self._pop(item_json['id'])
+        return self._updated(item_json, self._sb.update_item(item_json), cached)
+
+    def update_items(self, items_json):
+        for item in items_json:
+            self.invalidate(item['id'])
+        return self._sb.update_items(items_json)
+
+    def updateSbItem(self, item_json):
+        cached = self._pop(item_json['id'])
+        return self._updated(item_json, self._sb.updateSbItem(item_json), cached)
+
+    def delete_item(self, item_json):
+        self.invalidate(item_json['id'])
+        return self._sb.delete_item(item_json)
+
+    def delete_items(self, itemIds):
+        for itemid in itemIds:
+            self.invalidate(itemid)
+        return self._sb.delete_items(itemIds)
+
+    def upload_file_to_item(self, item, filename, *args, **kwargs):
+        self.invalidate(item['id'])
+        return self._store(self._sb.upload_file_to_item(item, filename, *args, **kwargs))
+
+    def upload_files_and_update_item(self, item, filenames, *args, **kwargs):
+        self.invalidate(item['id'])
+        return self._store(self._sb.upload_files_and_update_item(item, filenames, *args, **kwargs))
+
+    def upload_files_and_upsert_item(self, item, filenames, *args, **kwargs):
+        if 'id' in item:
+            self.invalidate(item['id'])
+        return self._store(self._sb.upload_files_and_upsert_item(item, filenames, *args, **kwargs))
+
+    def replace_file(self, filename, item):
+        self.invalidate(item['id'])
+        return self._sb.replace_file(filename, item)
+
+def pool_session_connections(sb, max_connections=32):
+    # Let the requests.Session behind an SbSession (or wrapper) keep up to max_connections keep-alive connections.
+    # The adapter is only mounted when the session's pool is smaller, so its open connections are kept.
+    session = getattr(sb, '_session', None)
+    if session is None or not hasattr(session, 'mount'):
+        return False
+    if getattr(session.get_adapter('https://'), '_pool_maxsize', 0) >= max_connections:
+        return True
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_connections)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return True
+
+class AsyncSbClient(object):
+    # asyncio facade over an SbSession for the calls autoSB makes.
+    # Each call runs on a pool of max_connections threads that share the session's pooled keep-alive
+    # connections, so a coroutine can keep up to max_connections requests in flight.
+    # The sync adapters (map, get_items) run a batch to completion on the same threads for use in the
+    # existing functions. They do not start an event loop, so they also work where one is already running
+    # (IPython, Spyder, Jupyter).
+    # Pass an executor to share its threads between clients; it is then left running by close().
+    def __init__(self, sb, max_connections=32, executor=None):
+        self.sb = sb
+        self.max_connections = max_connections
+        self._own_executor = executor is None
+        self._executor = ThreadPoolExecutor(max_workers=max_connections) if executor is None else executor
+        self.caller = _calling_function() # coroutines do not see who is awaiting them, so credit calls to the creator
+        pool_session_connections(sb, max_connections)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._own_executor:
+            self._executor.shutdown(wait=True)
+
+    async def _call(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(getattr(self.sb, method), *args, **kwargs)
+        return await loop.run_in_executor(self._executor, _with_caller(call, self.caller))
+
+    async def get_item(self, itemid, params=None):
+        return await self._call('get_item', itemid, params)
+
+    async def get_child_ids(self, parentid):
+        return await self._call('get_child_ids', parentid)
+
+    async def get_ancestor_ids(self, parentid):
+        return await self._call('get_ancestor_ids', parentid)
+
+    async def find_items_by_title(self, text):
+        return await self._call('find_items_by_title', text)
+
+    async def create_item(self, item_json):
+        return await self._call('create_item', item_json)
+
+    async def update_item(self, item_json):
+        return await self._call('update_item', item_json)
+
+    async def delete_items(self, itemIds):
+        return await self._call('delete_items', itemIds)
+
+    async def upload_file_to_item(self, item, filename, scrape_file=True):
+        return await self._call('upload_file_to_item', item, filename, scrape_file)
+
+    async def upload_files_and_upsert_item(self, item, filenames, scrape_file=True):
+        return await self._call('upload_files_and_upsert_item', item, filenames, scrape_file)
+
+    async def gather(self, method, arglist):
+        # Run method once per argument tuple concurrently; exceptions are returned in place of results.
+        calls = [getattr(self, method)(*args) for args in arglist]
+        return await asyncio.gather(*calls, return_exceptions=True)
+
+    def map(self, method, arglist):
+        # Sync counterpart of gather(). Results are in the order of arglist; exceptions are returned in place of results.
+        call = getattr(self.sb, method)
+        def call_one(args):
+            try:
+                return call(*args)
+            except Exception as e:
+                return e
+        return list(self._executor.map(_with_caller(call_one), [args if type(args) is tuple else (args,) for args in arglist]))
+
+    def get_items(self, itemids, verbose=False):
+        # Sync adapter: {ID: item} for every ID that could be fetched.
+        itemids = list(OrderedDict.fromkeys(i for i in itemids if i))
+        items = {}
+        for itemid, item in zip(itemids, self.map('get_item', itemids)):
+            if isinstance(item, Exception):
+                if verbose:
+                    print("Could not get item {}: {}".format(itemid, item))
+            else:
+                items[itemid] = item
+        return items
+
+_prefetch_executors = {} # {max_connections: thread pool} reused by prefetch_items()
+_prefetch_lock = threading.Lock()
+
+def _shared_executor(max_connections):
+    # The prefetch_items() pool of max_connections threads, created on first use.
+    with _prefetch_lock:
+        if not max_connections in _prefetch_executors:
+            _prefetch_executors[max_connections] = ThreadPoolExecutor(max_workers=max_connections)
+        return _prefetch_executors[max_connections]
+
+def prefetch_items(sb, itemids, max_connections=32):
+    # Fetch many items concurrently, e.g. to fill a CachedSbSession before a per-XML loop. Returns {ID: item}.
+    with AsyncSbClient(sb, max_connections, executor=_shared_executor(max_connections)) as client:
+        return client.get_items(itemids)
+
+class InstrumentedSbSession(object):
+    # Count every call to the wrapped session (SbSession, FakeSbSession or another wrapper) by the
+    # autoSB function that made it, with cumulative seconds and bytes sent and received.
+    # Put it directly around the SbSession (before CachedSbSession) so that only real requests are counted.
+    # Bytes are estimated from the JSON of items sent and received and the size of uploaded files.
+    def __init__(self, sb):
+        self._sb = sb
+        self.stats = {} # {(function, method): {'calls', 'seconds', 'bytes_sent', 'bytes_received', 'errors'}}
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._sb, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            if name == 'next' and not (args and isinstance(args[0], dict) and 'nextlink' in args[0]):
+                return attr(*args, **kwargs) # the last page of a search; no request is made
+            caller = _calling_function()
+            start = time.perf_counter()
+            error = False
+            result = None
+            try:
+                result = attr(*args, **kwargs)
+                return result
+            except Exception:
+                error = True
+                raise
+            finally:
+                seconds = time.perf_counter() - start
+                sent = 0 if name == 'next' else _payload_size(args) + _payload_size(kwargs.values()) # next() only sends the link
+                self._record(caller, name, seconds, sent, _payload_size([result]), error)
+        return call
+
+    def _record(self, function, method, seconds, sent, received, error):
+        with self._lock:
+            stat = self.stats.setdefault((function, method), {'calls': 0, 'seconds': 0.0, 'bytes_sent': 0,
+                                                              'bytes_received': 0, 'errors': 0})
+            stat['calls'] += 1
+            stat['seconds'] += seconds
+            stat['bytes_sent'] += sent
+            stat['bytes_received'] += received
+            stat['errors'] += int(error)
+
+    def report(self):
+        # List of rows sorted by cumulative time.
+        with self._lock:
+            rows = [dict(function=f, method=m, **stat) for (f, m), stat in self.stats.items()]
+        return sorted(rows, key=lambda r: r['seconds'], reverse=True)
+
+    def print_report(self):
+        rows = self.report()
+        print('\n{:<32} {:<30} {:>7} {:>9} {:>10} {:>10}'.format('function', 'ScienceBase call', 'calls', 'seconds', 'KB sent', 'KB recv'))
+        for r in rows:
+            print('{:<32} {:<30} {:>7} {:>9.2f} {:>10.1f} {:>10.1f}'.format(trunc(r['function'], 32), trunc(r['method'], 30),
+                  r['calls'], r['seconds'], r['bytes_sent'] / 1000, r['bytes_received'] / 1000))
+        print('{:<32} {:<30} {:>7} {:>9.2f}'.format('total', '', sum(r['calls'] for r in rows), sum(r['seconds'] for r in rows)))
+
+    def save_report(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        return fname
+
+class ItemProxy(object):
+    # Pending field changes for one page, compared with the last copy of the item received from SB.
+    # A field set back to its SB value is no longer dirty; None removes a field (as in inherit_SBfields).
+    # partial=True when the SB copy is unknown: every field set is then treated as changed.
+    def __init__(self, item, partial=False):
+        self.id = item['id']
+        self.base = copy.deepcopy(item)
+        self.partial = partial
+        self.changes = {}
+
+    def set(self, item_json):
+        for field, value in item_json.items():
+            if field in ('id', 'link', 'hasChildren'):
+                continue
+            if self.partial:
+                self.changes[field] = copy.deepcopy(value)
+            elif (value is None and not field in self.base) or (field in self.base and self.base[field] == value):
+                self.changes.pop(field, None)
+            else:
+                self.changes[field] = copy.deepcopy(value)
+
+    def is_dirty(self):
+        return bool(self.changes)
+
+    def item(self):
+        # The item as it will be on SB after the write.
+        item = copy.deepcopy(self.base)
+        for field, value in self.changes.items():
+            if value is None:
+                item.pop(field, None)
+            else:
+                item[field] = copy.deepcopy(value)
+        return item
+
+    def payload(self):
+        # Minimal JSON for the write: the ID and the changed fields.
+        payload = copy.deepcopy(self.changes)
+        payload['id'] = self.id
+        return payload
+
+class WriteBackSbSession(object):
+    # Hold update_item() calls in memory and write each page once, at flush().
+    # - update_item() records the changed fields in an ItemProxy and returns the item as it will be.
+    # - get_item() returns the pending version of a page.
+    # - Uploads carry the pending changes for that page, so no separate write is needed.
+    # - flush() writes only the pages with changes, with only the changed fields, batch_size pages per request.
+    # Call flush() (or flush_writes()) before anything that reads the pages from SB by other means.
+    def __init__(self, sb, batch_size=100):
+        self._sb = sb
+        self.batch_size = batch_size
+        self.writes = 0
+        self.skipped = 0
+        self._proxies = {}
+        self._lock = threading.RLock()
+
+    def __getattr__(self, name):
+        return getattr(self._sb, name)
+
+    def _received(self, item):
+        # Record the item as it is on SB (after a read or a write that went through).
+        # Returns the item with any pending changes applied.
+        if not isinstance(item, dict) or not 'id' in item:
+            return item
+        with self._lock:
+            proxy = self._proxies.get(item['id'])
+            if proxy and proxy.is_dirty():
+                changes = proxy.changes
+                proxy.base = copy.deepcopy(item)
+                proxy.partial = False
+                proxy.changes = {}
+                proxy.set(changes)
+                return proxy.item()
+            self._proxies[item['id']] = ItemProxy(item)
+        return item
+
+    def get_item(self, itemid, params=None):
+        if params: # partial JSON is passed through
+            return self._sb.get_item(itemid, params)
+        with self._lock:
+            proxy = self._proxies.get(itemid)
+            if proxy and proxy.is_dirty() and not proxy.partial:
+                return proxy.item()
+        return self._received(self._sb.get_item(itemid))
+
+    def update_item(self, item_json):
+        with self._lock:
+            proxy = self._proxies.get(item_json['id'])
+            if proxy is None: # not read through this session (e.g. from a ReleaseSnapshot)
+                proxy = self._proxies[item_json['id']] = ItemProxy({'id': item_json['id']}, partial=True)
+            proxy.set(item_json)
+            if not proxy.partial:
+                return proxy.item()
+            # Without the SB copy, return what the caller sent plus any earlier changes.
+            item = copy.deepcopy(item_json)
+            item.update(copy.deepcopy(proxy.changes))
+            return {k: v for k, v in item.items() if v is not None}
+
+    def updateSbItem(self, item_json):
+        return self.update_item(item_json)
+
+    def update_items(self, items_json):
+        return [self.update_item(item_json) for item_json in items_json]
+
+    def _pending(self, item):
+        # The item passed to an upload, with any pending changes for that page added.
+        # The changes stay pending until the upload has gone through (see _upload()).
+        with self._lock:
+            proxy = self._proxies.get(item.get('id'))
+            if proxy and proxy.is_dirty():
+                item = dict(item)
+                item.update(copy.deepcopy(proxy.changes))
+        return item
+
+    def _upload(self, method, item, *args, **kwargs):
+        # Upload with the pending changes; drop them only once SB has the item, so a failed upload loses nothing.
+        response = getattr(self._sb, method)(self._pending(item), *args, **kwargs)
+        self.discard(item.get('id'))
+        return self._received(response)
+
+    def upload_file_to_item(self, item, filename, *args, **kwargs):
+        return self._upload('upload_file_to_item', item, filename, *args, **kwargs)
+
+    def upload_files_and_update_item(self, item, filenames, *args, **kwargs):
+        return self._upload('upload_files_and_update_item', item, filenames, *args, **kwargs)
+
+    def upload_files_and_upsert_item(self, item, filenames, *args, **kwargs):
+        return self._upload('upload_files_and_upsert_item', item, filenames, *args, **kwargs)
+
+    def delete_item(self, item_json):
+        self.discard(item_json['id'])
+        return self._sb.delete_item(item_json)
+
+    def delete_items(self, itemIds):
+        for itemid in itemIds:
+            self.discard(itemid)
+        return self._sb.delete_items(itemIds)
+
+    def discard(self, itemid):
+        with self._lock:
+            self._proxies.pop(itemid, None)
+
+    def pending_ids(self):
+        with self._lock:
+            return [itemid for itemid, proxy in self._proxies.items() if proxy.is_dirty()]
+
+    def flush(self, itemids=None, verbose=False):
+        # Write the pending changes (for itemids, or all pages). Returns the number of pages written.
+        with self._lock:
+            proxies = [p for p in self._proxies.values() if itemids is None or p.id in itemids]
+            dirty = [p for p in proxies if p.is_dirty()]
+            self.skipped += len(proxies) - len(dirty)
+        for i in range(0, len(dirty), self.batch_size):
+            batch = dirty[i:i + self.batch_size]
+            if len(batch) > 1 and hasattr(self._sb, 'update_items'):
+                self._sb.update_items([p.payload() for p in batch])
+            else:
+                for proxy in batch:
+                    self._sb.update_item(proxy.payload())
+            with self._lock:
+                for proxy in batch:
+                    self._proxies[proxy.id] = ItemProxy(proxy.item())
+        self.writes += len(dirty)
+        if verbose:
+            print("Wrote {} pages with changes.".format(len(dirty)))
+        return len(dirty)
+
+def flush_writes(sb, verbose=False, itemids=None):
+    # Write pending page changes (for itemids, or all pages) if sb holds them (WriteBackSbSession); otherwise do nothing.
+    if hasattr(sb, 'pending_ids'):
+        return sb.flush(itemids, verbose=verbose)
+    return 0
+
+_call_context = threading.local() # .caller: the autoSB function that handed the current work to a pool thread
+
+def _with_caller(fn, caller=None):
+    # Wrap fn for a pool thread so that the SB calls it makes are credited to caller
+    # (by default the autoSB function submitting it) rather than to the thread machinery.
+    if caller is None:
+        caller = _calling_function()
+    def run_as_caller(*args, **kwargs):
+        outer = getattr(_call_context, 'caller', None)
+        _call_context.caller = caller
         try:
-            sb = pysb.SbSession(env=None).login(username, password)
-        except Exception as e: # 'Login failed' returned as Exception for bad password in login()
-            print('{}. Try reentering...'.format(e))
-            sb = pysb.SbSession(env=None).loginc(username) # 'Invalid password, try again' printed for bad password
-        except NameError as e:
-            print('{}. Try reentering...'.format(e))
-            sb = pysb.SbSession(env=None).loginc(username)
-    return sb
+            return fn(*args, **kwargs)
+        finally:
+            _call_context.caller = outer
+    return run_as_caller
+
+def _calling_function():
+    # Name of the nearest autoSB function on the stack, skipping the session wrappers and the functions
+    # that only hand work to pools. On a pool thread with no such function, the function that submitted the work.
+    wrappers = (SbSessionManager, CachedSbSession, InstrumentedSbSession, AsyncSbClient, WriteBackSbSession, ItemProxy)
+    plumbing = set(w.__name__ for w in wrappers) | {'_with_caller', 'run_as_caller', 'call_one', 'prefetch_items',
+                                                    'walk_topdown', 'visit', 'walk_bottomup'}
+    frame = sys._getframe(2)
+    outer = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__ and not isinstance(frame.f_locals.get('self'), wrappers):
+            name = getattr(code, 'co_qualname', code.co_name).split('.<locals>')[0]
+            if not name.split('.')[0] in plumbing and not code.co_name in plumbing:
+                return name
+        if outer is None and not code.co_filename == __file__:
+            outer = '{} ({})'.format(code.co_name, os.path.basename(code.co_filename))
+        frame = frame.f_back
+    return getattr(_call_context, 'caller', None) or outer or '(unknown)'
+
+def _payload_size(values):
+    # Approximate bytes of the items or files in a list of call arguments or results.
+    size = 0
+    for value in values:
+        if isinstance(value, (dict, list)):
+            if isinstance(value, list) and value and all(isinstance(v, str) for v in value):
+                size += sum(os.path.getsize(v) if os.path.isfile(v) else len(v) for v in value)
+            else:
+                size += len(json.dumps(value, default=str))
+        elif isinstance(value, str):
+            size += os.path.getsize(value) if os.path.isfile(value) else len(value)
+    return size
 
 def log_in2(username=False, password=False, sb=[]):
     if not sb.is_logged_in():
@@ -579,68 +1389,205 @@ def rename_dirs_from_xmls(parentdir, rename_intermediates=True):
     print("Renamed {} directories.".format(ct))
     return
 
-def setup_subparents(sb, parentdir, landing_id, imagefile, verbose=True):
+def setup_subparents(sb, parentdir, landing_id, imagefile, verbose=True, max_workers=8, batch_size=100):
+    # Find or create a SB page for every directory that holds XMLs (and the directories above them).
+    # The directories are listed from the local tree first and handled one depth level at a time:
+    # the existing children of that level's parents are listed (max_workers at once) and the missing
+    # pages of the whole level are created with create_items(), batch_size pages per request.
     landing_item = sb.get_item(landing_id)
     # Initialize dictionaries
     dict_DIRtoID = {os.path.basename(parentdir): landing_id} # Initialize [top dir/file: ID] entry to dict
+    title_index = ChildTitleIndex(sb)
     # List XML files
     xmllist = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
+    # Directory pages needed, by depth below parentdir
+    levels = {}
     for xml_file in xmllist:
         # get relative path from parentdir to XML, including parentdir
         relpath = os.path.relpath(xml_file, os.path.dirname(parentdir))
-        # Find or create the SB page for each directory
         dirchain = splitall2(os.path.dirname(relpath))
-        for dirpath in dirchain[1:]:
+        for depth, dirpath in enumerate(dirchain[1:]):
+            levels.setdefault(depth, set()).add(dirpath)
+    subpages = {} # {dirpath: item} for pages created here or fetched to upload the image
+    for depth in sorted(levels):
+        dirpaths = sorted(levels[depth])
+        title_index.prefetch([dict_DIRtoID[os.path.dirname(d)] for d in dirpaths], max_workers)
+        # Find existing pages
+        new_pages = []
+        for dirpath in dirpaths:
             parent_id = dict_DIRtoID[os.path.dirname(dirpath)] # get ID for parent
-            if dirpath in dict_DIRtoID:
-                continue
-            subpage = find_or_create_child(sb, parent_id, os.path.basename(dirpath), verbose=verbose) # get JSON for subpage based on parent ID and dirpath
-            if not imagefile == False:
-                subpage = sb.upload_file_to_item(subpage, imagefile)
-            # store values in dictionaries
-            dict_DIRtoID[dirpath] = subpage['id']
+            child_id = title_index.get(parent_id, os.path.basename(dirpath))
+            if child_id:
+                dict_DIRtoID[dirpath] = child_id
+                if verbose:
+                    print("FOUND: page '{}'.".format(trunc(os.path.basename(dirpath))))
+            else:
+                new_pages.append(dirpath)
+        # Create the rest of the level
+        for i in range(0, len(new_pages), batch_size):
+            batch = new_pages[i:i + batch_size]
+            items = sb.create_items([{'parentId': dict_DIRtoID[os.path.dirname(d)], 'title': os.path.basename(d)} for d in batch])
+            # The pages come back in the order they were requested (SB may change a title, e.g. trim it)
+            for dirpath, item in zip(batch, items):
+                parent_id = dict_DIRtoID[os.path.dirname(dirpath)]
+                subpages[dirpath] = item
+                dict_DIRtoID[dirpath] = item['id']
+                title_index.add(parent_id, os.path.basename(dirpath), item['id'])
+                title_index.created.append(item['id'])
+                title_index.parents.setdefault(item['id'], {}) # a new page has no children to list
+                if verbose:
+                    print("CREATED PAGE: '{}' in '{}.'".format(trunc(item['title'], 40), os.path.dirname(dirpath)))
+    if not imagefile == False:
+        for depth in sorted(levels):
+            for dirpath in sorted(levels[depth]):
+                subpage = subpages.get(dirpath) or sb.get_item(dict_DIRtoID[dirpath])
+                sb.upload_file_to_item(subpage, imagefile)
+    # Later stages find the pages by searching SB, so wait until the new ones show up.
+    wait_for_pages(sb, landing_id, title_index.created, verbose=verbose)
     return(dict_DIRtoID)
 
-def inherit_SBfields(sb, child_item, inheritedfields=['citation'], verbose=False, inherit_void=True):
+def plan_inheritance(child_item, parent_item, inheritedfields=['citation'], inherit_void=True, verbose=False):
+    # Fields that child_item must change to match parent_item for inheritedfields: {field: new value}.
+    # A value of None removes the field (when the parent does not have it and inherit_void is True).
+    # Fields that already match are left out, so an empty dict means the child is up to date.
+    changes = {}
+    for field in inheritedfields:
+        if not field in parent_item:
+            if inherit_void:
+                if child_item.get(field) is not None:
+                    changes[field] = None
+            elif verbose:
+                print("Field '{}' does not exist in parent and inherit_void is set to False so the current value will be preserved in child '{}'.".format(field, trunc(child_item['title'])))
+        elif not child_item.get(field) == parent_item[field]:
+            changes[field] = copy.deepcopy(parent_item[field])
+    return changes
+
+def inherit_SBfields(sb, child_item, inheritedfields=['citation'], verbose=False, inherit_void=True, parent_item=None):
     # Upsert inheritedfield from parent to child by retrieving parent_item based on child
     # Modified 3/8/17: if field does not exist in parent, remove in child
     # If field is entered incorrecly, no errors will be thrown, but the page will not be updated.
-    parent_item = flexibly_get_item(sb, child_item['parentId'])
+    # Pass parent_item if it has already been fetched to avoid getting it again.
+    # Only the fields that differ from the parent are sent (see plan_inheritance()); if none differ, nothing is written.
+    if not parent_item:
+        parent_item = flexibly_get_item(sb, child_item['parentId'])
     if verbose:
         print("Inheriting fields from parent '{}'".format(trunc(parent_item['title'])))
-    for field in inheritedfields:
-        if not field in parent_item:
-            if inherit_void:
-                child_item[field] = None
-            else:
-                print("Field '{}' does not exist in parent and inherit_void is set to False so the current value will be preserved in child '{}'.".format(field, trunc(child_item['title'])))
-        else:
-            try:
-                child_item[field] = parent_item[field]
-            except Exception as e:
-                print(e)
-                pass
-    child_item = sb.update_item(child_item)
+    changes = plan_inheritance(child_item, parent_item, inheritedfields, inherit_void, verbose=True)
+    if not changes:
+        return(child_item)
+    payload = dict(changes)
+    payload['id'] = child_item['id']
+    sb.update_item(payload)
+    child_item.update(changes)
+    for field, value in changes.items():
+        if value is None:
+            del child_item[field]
     return(child_item)
 
-def find_or_create_child(sb, parentid, child_title, verbose=False):
+class ChildTitleIndex(object):
+    # {parent ID: {title: child ID}}. The children of each parent are listed once, with one title-only
+    # search (paged at max_per_page), and pages created through find_or_create_child() are added.
+    # The IDs of those new pages are kept in created, for wait_for_pages().
+    def __init__(self, sb, max_per_page=1000):
+        self.sb = sb
+        self.max_per_page = max_per_page
+        self.parents = {}
+        self.created = []
+        self._lock = threading.RLock()
+
+    def titles(self, parentid):
+        with self._lock:
+            if parentid in self.parents:
+                return self.parents[parentid]
+        index = self._list(parentid)
+        with self._lock:
+            return self.parents.setdefault(parentid, index)
+
+    def _list(self, parentid):
+        index = {}
+        params = {'filter': 'parentIdExcludingLinks={}'.format(parentid), 'fields': 'title', 'max': self.max_per_page}
+        items = self.sb.find_items(params)
+        while items and 'items' in items:
+            for item in items['items']:
+                index.setdefault(item['title'], item['id']) # keep the first, as the old loop did
+            items = self.sb.next(items)
+        return index
+
+    def prefetch(self, parentids, max_workers=8):
+        # List the children of several parents at once.
+        with self._lock:
+            parentids = [pid for pid in set(parentids) if not pid in self.parents]
+        if parentids:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(self.titles, parentids))
+
+    def get(self, parentid, title):
+        return self.titles(parentid).get(title)
+
+    def add(self, parentid, title, childid):
+        with self._lock:
+            self.titles(parentid).setdefault(title, childid)
+
+    def remove(self, parentid, title):
+        with self._lock:
+            self.parents.get(parentid, {}).pop(title, None)
+
+def find_or_create_child(sb, parentid, child_title, verbose=False, title_index=None):
     # Find or create new child page
-    for child_id in sb.get_child_ids(parentid): # Check if child page already exists
+    # Children are looked up by title in title_index (a ChildTitleIndex); pass the same index to every call
+    # so that each parent is listed only once. Without one, the parent's children are listed for this call.
+    if title_index is None:
+        title_index = ChildTitleIndex(sb)
+    child_id = title_index.get(parentid, child_title)
+    if child_id: # Check if child page already exists
         child_item = sb.get_item(child_id)
-        if child_item['title'] == child_title:
-            if verbose:
-                print("FOUND: page '{}'.".format(trunc(child_title)))
-            break
+        if verbose:
+            print("FOUND: page '{}'.".format(trunc(child_title)))
     else: # If child doesn't already exist, create
         child_item = {}
         child_item['parentId'] = parentid
         child_item['title'] = child_title
         child_item = sb.create_item(child_item)
+        title_index.add(parentid, child_title, child_item['id'])
+        title_index.created.append(child_item['id'])
+        title_index.parents.setdefault(child_item['id'], {}) # a new page has no children to list
         if verbose:
-            print("CREATED PAGE: '{}' in '{}.'".format(trunc(child_title, 40), sb.get_item(parentid)['title']))
-        time.sleep(1) # wait 1 sec to ensure that page is registered
+            print("CREATED PAGE: '{}' in '{}.'".format(trunc(child_title, 40), parentid))
+        # New pages may not show up in searches right away; see wait_for_pages().
     return child_item
 
+def poll_with_backoff(check, timeout=120, first_wait=0.5, max_wait=10):
+    # Call check() until it returns a falsy value or timeout seconds have passed; the wait between
+    # calls doubles from first_wait up to max_wait. Returns (last result, number of calls, seconds).
+    start = time.time()
+    wait_secs = first_wait
+    ct_checks = 0
+    while True:
+        result = check()
+        ct_checks += 1
+        if not result or time.time() - start + wait_secs > timeout:
+            return result, ct_checks, time.time() - start
+        time.sleep(wait_secs)
+        wait_secs = min(wait_secs * 2, max_wait)
+
+def wait_for_pages(sb, top_id, page_ids, timeout=120, first_wait=0.5, max_wait=10, verbose=True):
+    # Wait until page_ids show up among the descendants of top_id in SB searches, which lag behind creation.
+    # Each check is one ancestor query for all of the pages; the wait between checks doubles from
+    # first_wait up to max_wait. Returns the IDs still missing after timeout seconds (printed as stragglers).
+    missing = set(page_ids)
+    if not missing:
+        return []
+    def check():
+        missing.difference_update(sb.get_ancestor_ids(top_id))
+        return missing
+    missing, ct_checks, secs = poll_with_backoff(check, timeout, first_wait, max_wait)
+    if verbose:
+        print("{} of {} new pages visible in SB after {:.1f} seconds ({} checks).".format(
+            len(set(page_ids)) - len(missing), len(set(page_ids)), secs, ct_checks))
+        for pid in missing:
+            print("STRAGGLER: page {} does not show up in SB searches yet.".format(pid))
+    return list(missing)
+
 def get_file_upload_time(data_item, file_type='application/fgdc+xml'):
     time_uploaded = None
     if 'files' in data_item:
@@ -682,30 +1629,34 @@ def upsert_metadata(sb, id_or_item, xml_file):
     return(data_item)
 
 #%% Update SB preview image from the uploaded files.
-def update_all_browse_graphics(sb, parentdir, landing_id, valid_ids=None, verbose=False):
+def update_all_browse_graphics(sb, parentdir, landing_id, valid_ids=None, verbose=False, resolver=None):
     # Update SB preview image from the uploaded files and update filename and type in XML.
     # For every XML in the parentdir (recursive)...
     print("Updating browse graphic information...")
     xmllist = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
     for xml_file in xmllist:
         # Get SB page ID from the XML (needs to be up-to-date)
-        datapageid = get_pageid_from_xmlpath(xml_file, sb, valid_ids=valid_ids, parentdir=parentdir, verbose=verbose)
+        datapageid = get_pageid_from_xmlpath(xml_file, sb, valid_ids=valid_ids, parentdir=parentdir, verbose=verbose, resolver=resolver)
         # Run update_browse() to match the XML values with the image file on the SB page. Get browse caption from the XML. Get name of *browse* image file on SB and set as preview. Update the filename and type in the XML.
         if update_browse(sb, xml_file, datapageid, verbose):
             # if the XML was updated, replace the XML on the page.
             data_item = upsert_metadata(sb, datapageid, xml_file)
     return
 
-def upload_all_updated_xmls(sb, parentdir, valid_ids=None):
+def upload_all_updated_xmls(sb, parentdir, valid_ids=None, max_connections=1, resolver=None):
     # Upload XMLs that have been updated since last upload to SB.
     # Iterates through local XMLs rather than starting on SB
+    # With max_connections > 1, the data pages are fetched concurrently before the XMLs are compared.
+    # Returns the IDs of the pages whose XML was uploaded.
     ct = 0
+    uploaded_ids = []
     xmllist = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
     print("Searching {} XML files for changes since last upload...".format(len(xmllist)))
-    for xml_file in xmllist:
-        # Get SB JSON item that corresponds to XML file (try matching folder name to SB or get second link in XML citeinfo) # Get page_id from the SB title or the SB citation in the XML file.
-        datapageid = get_pageid_from_xmlpath(xml_file, sb, valid_ids=valid_ids, parentdir=parentdir)
-        data_item = flexibly_get_item(sb, datapageid, output='item')
+    # Get SB JSON item that corresponds to XML file (try matching folder name to SB or get second link in XML citeinfo) # Get page_id from the SB title or the SB citation in the XML file.
+    pageids = [get_pageid_from_xmlpath(xml_file, sb, valid_ids=valid_ids, parentdir=parentdir, resolver=resolver) for xml_file in xmllist]
+    items = prefetch_items(sb, pageids, max_connections) if max_connections > 1 else {}
+    for xml_file, datapageid in zip(xmllist, pageids):
+        data_item = items.get(datapageid) or flexibly_get_item(sb, datapageid, output='item')
         # Get upload time of XML as UTC datetime object
         xml_uploaded = get_file_upload_time(data_item, file_type='application/fgdc+xml')
         xml_uploaded = datetime.strptime(xml_uploaded, '%Y-%m-%dT%H:%M:%SZ')
@@ -716,11 +1667,12 @@ def upload_all_updated_xmls(sb, parentdir, valid_ids=None):
             data_item = upsert_metadata(sb, data_item, xml_file)
             # print('UPLOADED: {}'.format(os.path.basename(xml_file)))
             ct += 1
+            uploaded_ids.append(data_item['id'])
     if ct > 0:
         print("Found and uploaded {} XML files.\n".format(ct))
     else:
         print("No XMLs have been updated since last upload.\n")
-    return
+    return uploaded_ids
 
 def replace_files_by_ext(sb, parentdir, dict_DIRtoID, match_str='*.xml', verbose=True):
     for root, dirs, files in os.walk(parentdir):
@@ -950,7 +1902,9 @@ def get_parent_bounds(sb, parent_id, verbose=False):
             parent_bounds = {}
         return parent_bounds
 
-def get_idlist_bottomup(sb, top_id):
+def get_idlist_bottomup(sb, top_id, snapshot=None):
+    if snapshot is not None: # any depth, deepest pages first
+        return [pid for level in reversed(snapshot.levels(top_id)) for pid in level]
     tier1 = sb.get_child_ids(top_id)
     tier2 = []
     for t1 in tier1:
@@ -962,11 +1916,295 @@ def get_idlist_bottomup(sb, top_id):
     idlist_bottomup.append(top_id)
     return idlist_bottomup
 
-def set_parent_extent(sb, top_id, verbose=False):
-    pagelist = get_idlist_bottomup(sb,top_id)
-    for page in pagelist:
-        parent_bounds = get_parent_bounds(sb, page, verbose)
-    return parent_bounds
+bbox_corners = ('minX', 'minY', 'maxX', 'maxY')
+extent_fields = ['title', 'parentId', 'hasChildren', 'facets', 'spatial']
+
+def get_item_bbox(item):
+    # Bounding box of a page: from its first facet (e.g. a shapefile) or else from its spatial field.
+    try:
+        return item['facets'][0]['boundingBox']
+    except (KeyError, IndexError, TypeError):
+        pass
+    try:
+        return item['spatial']['boundingBox']
+    except (KeyError, TypeError):
+        return None
+
+def union_bboxes(bboxes):
+    # Smallest bounding box that contains all of the given bounding boxes.
+    rows = [[float(bbox[c]) for c in bbox_corners] for bbox in bboxes if bbox]
+    if not rows:
+        return None
+    if np is not None:
+        arr = np.array(rows)
+        mins = arr[:, :2].min(axis=0)
+        maxs = arr[:, 2:].max(axis=0)
+        return dict(zip(bbox_corners, [float(v) for v in list(mins) + list(maxs)]))
+    return dict(zip(bbox_corners, [min(r[0] for r in rows), min(r[1] for r in rows),
+                                   max(r[2] for r in rows), max(r[3] for r in rows)]))
+
+def aggregate_extents(snapshot, top_id=None):
+    # Compute the extent of every page with children from the deepest level up.
+    # A child contributes its own bbox (facets first, like get_parent_bounds) or, if it has none,
+    # the extent computed for it from its own children. Returns {page ID: bbox} for those pages.
+    bounds = {}
+    for level in reversed(snapshot.levels(top_id)):
+        for pid in level:
+            child_ids = snapshot.children.get(pid, [])
+            if not child_ids:
+                continue
+            child_bboxes = []
+            for cid in child_ids:
+                child = snapshot.items[cid]
+                if cid in bounds and not child.get('facets'):
+                    child_bboxes.append(bounds[cid])
+                else:
+                    child_bboxes.append(get_item_bbox(child))
+            bbox = union_bboxes(child_bboxes)
+            if bbox:
+                bounds[pid] = bbox
+    return bounds
+
+def same_bbox(bbox1, bbox2):
+    if not bbox1 or not bbox2:
+        return False
+    return all(c in bbox1 and c in bbox2 and float(bbox1[c]) == float(bbox2[c]) for c in bbox_corners)
+
+def set_parent_extent(sb, top_id, verbose=False, snapshot=None, batch_size=100, changed_ids=None, extent_cache=None):
+    # Set spatial.boundingBox of every parent page (any depth) to the extent of its children.
+    # The page tree is read once (from snapshot or a new ReleaseSnapshot with extent_fields),
+    # extents are computed bottom-up in memory, and only parents whose bbox changed are written,
+    # batch_size pages per request. Returns {page ID: bbox} for the pages that were updated.
+    # extent_cache (see load_extent_cache()) is filled with the bbox of every page for the next run.
+    # If changed_ids (the data pages modified in this run) and a filled extent_cache are given,
+    # only the parents above those pages are recomputed; see update_extents_above().
+    if changed_ids is not None and extent_cache:
+        return update_extents_above(sb, top_id, changed_ids, extent_cache, verbose=verbose, snapshot=snapshot, batch_size=batch_size)
+    if snapshot is None:
+        snapshot = ReleaseSnapshot.load(sb, top_id, fields=extent_fields, verbose=verbose)
+    bounds = aggregate_extents(snapshot, top_id)
+    changes = {}
+    for pid, bbox in bounds.items():
+        item = snapshot.items[pid]
+        if same_bbox((item.get('spatial') or {}).get('boundingBox'), bbox):
+            continue
+        changes[pid] = bbox
+        if verbose:
+            print('Updated bounding box for parent "{}"'.format(item.get('title')))
+    write_extents(sb, changes, snapshot=snapshot, batch_size=batch_size)
+    if extent_cache is not None:
+        extent_cache.clear()
+        for pid, item in snapshot.items.items():
+            entry = {'parentId': item.get('parentId'), 'bbox': get_item_bbox(item)}
+            if item.get('facets'):
+                entry['facet'] = True
+            if pid in bounds:
+                entry['extent'] = bounds[pid]
+                if not item.get('facets'):
+                    entry['bbox'] = bounds[pid]
+            extent_cache[pid] = entry
+    if verbose:
+        print("Extent changed on {} of {} parent pages.".format(len(changes), len(bounds)))
+    return changes
+
+def update_extents_above(sb, top_id, changed_ids, extent_cache, verbose=False, snapshot=None, batch_size=100):
+    # Recompute the extents of only the parents above changed_ids, up to top_id.
+    # Children that did not change contribute the bbox saved in extent_cache by the previous run;
+    # a parent is written, and its own parent recomputed, only if its extent changed.
+    # Reads come from snapshot if given, otherwise from sb (one get_item() per changed page and one
+    # get_child_ids() per recomputed parent). extent_cache is updated. Returns {page ID: bbox} written.
+    src = snapshot if snapshot is not None else sb
+    def parent_of(pid):
+        if not pid in extent_cache:
+            item = src.get_item(pid)
+            extent_cache[pid] = {'parentId': item.get('parentId'), 'bbox': get_item_bbox(item), 'facet': bool(item.get('facets'))}
+        return extent_cache[pid]['parentId']
+    def depth(pid):
+        ct = 0
+        while pid and pid != top_id:
+            pid = parent_of(pid)
+            ct += 1
+        return ct
+    # Refresh the bbox of the changed pages
+    dirty = set()
+    for pid in set(changed_ids):
+        item = src.get_item(pid)
+        old = extent_cache.get(pid, {})
+        bbox = get_item_bbox(item)
+        if not item.get('facets') and old.get('extent'):
+            bbox = old['extent']
+        extent_cache[pid] = dict(old, parentId=item.get('parentId'), bbox=bbox, facet=bool(item.get('facets')))
+        if not same_bbox(old.get('bbox'), bbox) and pid != top_id:
+            dirty.add(item.get('parentId'))
+    # Recompute the parents from the deepest up; a parent whose extent changed makes its parent dirty
+    changes = {}
+    ct_parents = 0
+    while dirty:
+        pid = max(dirty, key=depth)
+        dirty.remove(pid)
+        ct_parents += 1
+        child_bboxes = []
+        for cid in src.get_child_ids(pid):
+            if not cid in extent_cache:
+                parent_of(cid)
+            child_bboxes.append(extent_cache[cid]['bbox'])
+        extent = union_bboxes(child_bboxes)
+        entry = extent_cache.setdefault(pid, {'parentId': parent_of(pid)})
+        if not extent or same_bbox(entry.get('extent'), extent):
+            continue
+        changes[pid] = extent
+        entry['extent'] = extent
+        if not entry.get('facet'): # the parent contributes its extent to its own parent
+            entry['bbox'] = extent
+            if pid != top_id:
+                dirty.add(entry['parentId'])
+        if verbose:
+            print('Updated bounding box for parent "{}"'.format(pid))
+    write_extents(sb, changes, snapshot=snapshot, batch_size=batch_size)
+    if verbose:
+        print("Extent changed on {} of {} recomputed parent pages.".format(len(changes), ct_parents))
+    return changes
+
+def write_extents(sb, extents, snapshot=None, batch_size=100):
+    # Write {page ID: bbox} as spatial.boundingBox, batch_size pages per request, and update snapshot.
+    changes = []
+    for pid, bbox in extents.items():
+        spatial = {}
+        if snapshot is not None and pid in snapshot:
+            spatial = dict(snapshot.items[pid].get('spatial') or {})
+        spatial['boundingBox'] = bbox
+        changes.append({'id': pid, 'spatial': spatial})
+    for i in range(0, len(changes), batch_size):
+        sb.update_items(changes[i:i + batch_size])
+    if snapshot is not None:
+        for change in changes:
+            if change['id'] in snapshot:
+                item = snapshot.get_item(change['id'])
+                item['spatial'] = change['spatial']
+                snapshot.add(item)
+    return changes
+
+def load_extent_cache(fname):
+    # {page ID: {'parentId', 'bbox', 'facet', 'extent'}} saved by save_extent_cache(), or {} if there is none.
+    if not os.path.isfile(fname):
+        return {}
+    with open(fname, 'r') as f:
+        return json.load(f)
+
+def save_extent_cache(fname, extent_cache):
+    with open(fname, 'w') as f:
+        json.dump(extent_cache, f)
+    return fname
+
+def read_shp_bbox(shp_file):
+    # Bounding box from the 100-byte .shp header (Xmin, Ymin, Xmax, Ymax as little-endian doubles at byte 36).
+    # Only the header is read. Returns None if the file is not a shapefile.
+    try:
+        with open(shp_file, 'rb') as f:
+            header = f.read(100)
+    except OSError:
+        return None
+    if len(header) < 100 or struct.unpack('>i', header[:4])[0] != 9994:
+        return None
+    minx, miny, maxx, maxy = struct.unpack('<4d', header[36:68])
+    return {'minX': minx, 'minY': miny, 'maxX': maxx, 'maxY': maxy}
+
+def shp_extents(parentdir, max_workers=8):
+    # {shp_file: bbox} for every .shp in the parentdir tree, read on max_workers threads.
+    shplist = glob.glob(os.path.join(parentdir, '**/*.[sS][hH][pP]'), recursive=True)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(shplist, pool.map(read_shp_bbox, shplist)))
+
+def is_geographic_bbox(bbox):
+    # True if the coordinates could be decimal degrees (shapefiles may be in projected units).
+    return bool(bbox) and -180 <= bbox['minX'] <= bbox['maxX'] <= 180 and -90 <= bbox['minY'] <= bbox['maxY'] <= 90
+
+def shp_bbox_for_xml(xml_file, shp_bboxes):
+    # Bbox of the shapefile described by xml_file (data_name.shp.xml or data_name.xml), or of all
+    # shapefiles in its directory if none has a matching name. Only geographic bboxes are used.
+    datadir = os.path.dirname(xml_file)
+    data_name = os.path.splitext(os.path.splitext(os.path.basename(xml_file))[0])[0]
+    in_dir = {f: bbox for f, bbox in shp_bboxes.items() if os.path.dirname(f) == datadir and is_geographic_bbox(bbox)}
+    matching = [bbox for f, bbox in in_dir.items() if os.path.splitext(os.path.basename(f))[0] == data_name]
+    return union_bboxes(matching or list(in_dir.values()))
+
+def check_xml_extents(parentdir, shp_bboxes=None, xml_extents=None, tolerance=0.0001, max_workers=8, verbose=True):
+    # Compare the FGDC bounding coordinates of each XML to the extent in its shapefile header(s).
+    # Returns [(xml_file, xml bbox, shp bbox)] for the XMLs whose bounding is missing or off by more
+    # than tolerance (degrees), i.e. the XMLs that need their spdom updated.
+    if shp_bboxes is None:
+        shp_bboxes = shp_extents(parentdir, max_workers)
+    if xml_extents is None:
+        xml_extents = {}
+    stale = []
+    for xml_file in glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True):
+        shp_bbox = shp_bbox_for_xml(xml_file, shp_bboxes)
+        if not shp_bbox:
+            continue
+        if not xml_file in xml_extents:
+            xml_extents[xml_file] = get_bbox_from_xml(xml_file)
+        xml_bbox = xml_extents[xml_file]
+        if not xml_bbox or any(abs(xml_bbox[c] - shp_bbox[c]) > tolerance for c in bbox_corners):
+            stale.append((xml_file, xml_bbox, shp_bbox))
+            if verbose:
+                print("ALERT: bounding in {} ({}) does not match the shapefile extent ({}).".format(
+                    os.path.basename(xml_file), xml_bbox, shp_bbox))
+    if verbose:
+        print("Checked XML bounding against {} shapefile headers: {} XMLs out of date.".format(len(shp_bboxes), len(stale)))
+    return stale
+
+def extents_from_xmls(parentdir, dict_DIRtoID, xml_extents=None, shp_bboxes=None):
+    # Extents of the data pages and all their parents from the FGDC bounding coordinates of the local XMLs.
+    # xml_extents is {xml_file: bbox} as filled by update_all_xmls(); XMLs not in it are read here.
+    # If shp_bboxes ({shp_file: bbox} from shp_extents()) is given, the shapefile header extent is used
+    # in place of the XML bounding where there is one.
+    # Each XML counts toward the page of its directory and every directory above it, up to parentdir.
+    # Returns {page ID: bbox} for the directories in dict_DIRtoID.
+    if xml_extents is None:
+        xml_extents = {}
+    dir_bboxes = {}
+    for xml_file in glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True):
+        bbox = shp_bbox_for_xml(xml_file, shp_bboxes) if shp_bboxes else None
+        if not bbox and not xml_file in xml_extents:
+            xml_extents[xml_file] = get_bbox_from_xml(xml_file)
+        bbox = bbox or xml_extents[xml_file]
+        if not bbox:
+            continue
+        relpath = os.path.relpath(os.path.dirname(xml_file), os.path.dirname(parentdir))
+        for dirpath in splitall2(relpath):
+            dir_bboxes.setdefault(dirpath, []).append(bbox)
+    extents = {}
+    for dirpath, bboxes in dir_bboxes.items():
+        if dirpath in dict_DIRtoID:
+            extents[dict_DIRtoID[dirpath]] = union_bboxes(bboxes)
+        else:
+            print("No page ID for directory '{}', so its extent was not set.".format(dirpath))
+    return extents
+
+def set_extent_from_xmls(sb, parentdir, dict_DIRtoID, xml_extents=None, snapshot=None, extent_cache=None, batch_size=100, verbose=False, shp_bboxes=None):
+    # Set spatial.boundingBox on the data pages and their parents from the local XMLs (see extents_from_xmls()),
+    # in one pass of update_items() batches. Nothing is read from SB. With a snapshot, pages whose bbox
+    # already matches are not written. extent_cache, if given, is updated for later incremental runs.
+    # Returns {page ID: bbox} for the pages that were written.
+    extents = extents_from_xmls(parentdir, dict_DIRtoID, xml_extents, shp_bboxes)
+    changes = {}
+    for pid, bbox in extents.items():
+        if snapshot is not None and pid in snapshot and same_bbox((snapshot.items[pid].get('spatial') or {}).get('boundingBox'), bbox):
+            continue
+        changes[pid] = bbox
+    write_extents(sb, changes, snapshot=snapshot, batch_size=batch_size)
+    if extent_cache is not None:
+        for pid, bbox in extents.items():
+            entry = extent_cache.get(pid)
+            if entry is None:
+                continue
+            if not entry.get('facet'):
+                entry['bbox'] = bbox
+            if 'extent' in entry:
+                entry['extent'] = bbox
+    if verbose:
+        print("Set the extent of {} of {} pages from the XMLs.".format(len(changes), len(extents)))
+    return changes
 
 def find_browse_file(datadir, searchterm='*browse*', extensions=('.png', '.jpg', '.jpeg', '.gif')):
     imagelist = []
@@ -1108,8 +2346,112 @@ def update_existing_fields(sb, parentdir, data_inherits, subparent_inherits, fna
     print("Fields updated and values items stored in dictionary: {}".format(fname_id2json))
     return True
 
-def get_pageid_from_xmlpath(xml_file, sb=None, dict_DIRtoID=None, valid_ids=None, parentid=None, parentdir=None, verbose=False):
+class PageIdResolver(object):
+    # Maps the XMLs of a data release to SB page IDs for a whole run, from local indexes:
+    # - XML path and directory path (relative to the folder above parentdir, as in dict_DIRtoID);
+    # - the page tree, by parent ID and title, so each directory is found under its parent's page;
+    # - page title, when it is unique in the release;
+    # - the page URLs in the XML citation onlinks.
+    # The tree, titles and valid IDs come from one paged search of the pages below top_id (load()),
+    # which is only run if a lookup misses dict_DIRtoID. XMLs that could not be resolved are remembered.
+    def __init__(self, sb, parentdir, top_id, dict_DIRtoID=None, valid_ids=None):
+        self.sb = sb
+        self.parentdir = parentdir
+        self.top_id = top_id
+        self.by_path = dict(dict_DIRtoID or {})
+        self.by_path.setdefault(os.path.basename(parentdir), top_id)
+        self.valid_ids = set(valid_ids) if valid_ids else None
+        self.by_parent_title = None # {(parent ID, title): page ID}; None until load()
+        self.by_title = {}
+        self.missing = set()
+        self._lock = threading.RLock()
+
+    def load(self, max_per_page=1000):
+        # Index the pages below top_id, with one paged search for their titles and parent IDs.
+        with self._lock:
+            if self.by_parent_title is not None or not self.sb:
+                return self
+            by_parent_title = {}
+            titles = {}
+            params = {'filter': 'ancestorsExcludingLinks={}'.format(self.top_id), 'fields': 'title,parentId', 'max': max_per_page}
+            items = self.sb.find_items(params)
+            while items and 'items' in items:
+                for item in items['items']:
+                    by_parent_title.setdefault((item.get('parentId'), item['title']), item['id'])
+                    titles.setdefault(item['title'], []).append(item['id'])
+                items = self.sb.next(items)
+            self.by_title = {title: ids[0] for title, ids in titles.items() if len(ids) == 1}
+            self.valid_ids = set(self.by_title.values()) | set(by_parent_title.values()) | {self.top_id}
+            self.by_parent_title = by_parent_title
+        return self
+
+    def add(self, path, page_id):
+        with self._lock:
+            self.by_path[path] = page_id
+            self.missing.discard(path)
+            if self.valid_ids is not None:
+                self.valid_ids.add(page_id)
+
+    def relpath(self, xml_file):
+        return os.path.relpath(os.path.dirname(xml_file), os.path.dirname(self.parentdir))
+
+    def _from_tree(self, relpath):
+        # Follow the directory path down the page tree from the page for parentdir.
+        page_id = None
+        for dirpath in splitall2(relpath):
+            if dirpath in self.by_path:
+                page_id = self.by_path[dirpath]
+                continue
+            if page_id is None:
+                return None
+            page_id = self.by_parent_title.get((page_id, os.path.basename(dirpath)))
+            if page_id is None:
+                return None
+            self.by_path[dirpath] = page_id
+        return page_id
+
+    def _from_onlink(self, xml_file):
+        metadata_root, tree, xml_file = get_root_flexibly(xml_file)
+        for link_elem in metadata_root.findall('./idinfo/citation/citeinfo/onlink'):
+            page_id = os.path.basename((link_elem.text or '').strip())
+            if page_id in self.valid_ids:
+                return page_id
+        return None
+
+    def resolve(self, xml_file, verbose=False):
+        # Page ID for xml_file, or None if it cannot be found.
+        if xml_file in self.missing:
+            return None
+        relpath = self.relpath(xml_file)
+        page_id = self.by_path.get(xml_file) or self.by_path.get(relpath)
+        if not page_id and self.sb:
+            self.load()
+            with self._lock:
+                page_id = self._from_tree(relpath)
+            if not page_id:
+                page_id = self.by_title.get(os.path.basename(os.path.dirname(xml_file)))
+                if page_id and verbose:
+                    print("Found page ID by XML folder name. Result: {}: {}".format(page_id, relpath))
+            if not page_id:
+                page_id = self._from_onlink(xml_file)
+                if page_id and verbose:
+                    print("Extracted page ID from the XML file. Result: {}: {}".format(page_id, relpath))
+        if not page_id:
+            with self._lock:
+                self.missing.add(xml_file)
+            print("Could not find page matching XML file {}. Possible causes: a folder name or page URL may have changed.".format(xml_file))
+            return None
+        if self.valid_ids is not None and not page_id in self.valid_ids:
+            print('ALERT: ID ({}) is not in valid ID list. -- PageIdResolver'.format(page_id))
+        with self._lock:
+            self.by_path[xml_file] = page_id
+        return page_id
+
+def get_pageid_from_xmlpath(xml_file, sb=None, dict_DIRtoID=None, valid_ids=None, parentid=None, parentdir=None, verbose=False, resolver=None):
     # Flexibly get page_id based on XML file, either from the directory:ID dict, the SB title, or the SB citation in the XML file.
+    # With a PageIdResolver, the lookup is done by the resolver and the other arguments are ignored.
+    if resolver is not None:
+        return resolver.resolve(xml_file, verbose=verbose)
     page_id = None # Initialize page_id as None
     # First try: try the directory:ID dictionary if provided
     if dict_DIRtoID and not page_id:
@@ -1164,26 +2506,228 @@ def get_pageid_from_xmlpath(xml_file, sb=None, dict_DIRtoID=None, valid_ids=None
 # Apply functions to entire data release page tree
 #
 ###################################################
-def delete_all_children(sb, parentid, verbose=False):
-    # Recursively delete all SB items that are descendants of the input page.
-    # Waits up to 5 seconds for the child items to be deleted.
+# Fields requested for every item when loading a ReleaseSnapshot
+snapshot_fields = ['title', 'parentId', 'hasChildren', 'citation', 'contacts', 'body', 'purpose',
+                   'webLinks', 'relatedItems', 'dates', 'facets', 'spatial', 'files', 'systemTypes']
+# Names allowed in the inherit lists that are not item fields. previewImage is set by uploading the image file
+# (see sb_automation.py), so inheriting it leaves the item alone and it need not be in a snapshot.
+pseudo_fields = ['previewImage']
+
+class ReleaseSnapshot(object):
+    # In-memory copy of a data release page tree: {id: item} and {parent ID: [child IDs]}.
+    # Loaded with paged ancestor searches (max_per_page items per request) instead of one request per page.
+    # Provides get_item() and get_child_ids() like an SbSession so that tree functions can read from it;
+    # writes still go to SB and the returned items should be put back with add().
+    def __init__(self, top_id):
+        self.top_id = top_id
+        self.items = {}
+        self.children = {}
+        self.fields = None # fields requested by load(); None if unknown
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, sb, top_id, fields=snapshot_fields, max_per_page=1000, verbose=False):
+        snapshot = cls(top_id)
+        snapshot.fields = list(fields)
+        snapshot.add(sb.get_item(top_id))
+        params = {'filter': 'ancestorsExcludingLinks={}'.format(top_id),
+                  'fields': ','.join(fields), 'max': max_per_page}
+        ct_requests = 1
+        items = sb.find_items(params)
+        while items and 'items' in items:
+            for item in items['items']:
+                snapshot.add(item)
+            if 'nextlink' in items:
+                ct_requests += 1 # the last page has no nextlink, and next() then returns None without a request
+            items = sb.next(items)
+        # Children can arrive before their parents, so set hasChildren from the finished index.
+        for itemid, item in snapshot.items.items():
+            item['hasChildren'] = len(snapshot.children.get(itemid, [])) > 0
+        if verbose:
+            print("Loaded {} pages under '{}' in {} requests.".format(len(snapshot.items), trunc(snapshot.items[top_id]['title']), ct_requests))
+        return snapshot
+
+    def add(self, item):
+        # Add or replace an item and index it under its parent.
+        with self._lock:
+            return self._add(item)
+
+    def _add(self, item):
+        itemid = item['id']
+        old = self.items.get(itemid)
+        if old and old.get('parentId') != item.get('parentId') and old.get('parentId') in self.children:
+            self.children[old['parentId']].remove(itemid)
+        if old and not 'hasChildren' in item:
+            item['hasChildren'] = old.get('hasChildren', False)
+        self.items[itemid] = item
+        parentid = item.get('parentId')
+        if parentid and not itemid == self.top_id:
+            siblings = self.children.setdefault(parentid, [])
+            if not itemid in siblings:
+                siblings.append(itemid)
+            if parentid in self.items:
+                self.items[parentid]['hasChildren'] = True
+        return item
+
+    def remove(self, itemid):
+        # Remove an item and its descendants from the snapshot.
+        with self._lock:
+            self._remove(itemid)
+
+    def _remove(self, itemid):
+        for cid in list(self.children.get(itemid, [])):
+            self._remove(cid)
+        self.children.pop(itemid, None)
+        item = self.items.pop(itemid, None)
+        if item and item.get('parentId') in self.children:
+            siblings = self.children[item['parentId']]
+            if itemid in siblings:
+                siblings.remove(itemid)
+            if not siblings and item['parentId'] in self.items:
+                self.items[item['parentId']]['hasChildren'] = False
+
+    def __contains__(self, itemid):
+        return itemid in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_item(self, itemid, params=None):
+        # Copy, because autoSB functions modify the items they are given.
+        return copy.deepcopy(self.items[itemid])
+
+    def get_child_ids(self, parentid):
+        return list(self.children.get(parentid, []))
+
+    def get_ancestor_ids(self, parentid):
+        # Named after SbSession.get_ancestor_ids(): IDs of all descendants of parentid.
+        return self.descendants(parentid)
+
+    def descendants(self, top_id=None):
+        # IDs of all descendants of top_id, parents before children.
+        ids = []
+        for level in self.levels(top_id)[1:]:
+            ids += level
+        return ids
+
+    def levels(self, top_id=None):
+        # List of ID lists by depth, starting with [top_id].
+        level = [top_id or self.top_id]
+        levels = []
+        while level:
+            levels.append(level)
+            level = [cid for pid in level for cid in self.children.get(pid, [])]
+        return levels
+
+    def ancestors(self, itemid):
+        # IDs from the parent of itemid up to the top of the snapshot.
+        chain = []
+        parentid = self.items[itemid].get('parentId')
+        while parentid in self.items:
+            chain.append(parentid)
+            if parentid == self.top_id:
+                break
+            parentid = self.items[parentid].get('parentId')
+        return chain
+
+def walk_topdown(src, top_id, task, max_workers=8, top_result=None):
+    # Run task(page_id, parent_result) for every descendant of top_id on a pool of max_workers threads.
+    # A page runs only after its parent has finished; the parent's return value is passed to its children
+    # (top_result for the children of top_id). Children are listed with src.get_child_ids(), where src is
+    # an SbSession or a ReleaseSnapshot. If a task returns an item with 'hasChildren' False, its children
+    # are not listed. Descendants of a page whose task failed are skipped.
+    # Returns {page ID: exception} for the pages that failed.
+    errors = {}
+    def visit(cid, parent_result):
+        result = task(cid, parent_result)
+        if isinstance(result, dict) and result.get('hasChildren') is False:
+            return result, []
+        return result, src.get_child_ids(cid)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        visit = _with_caller(visit)
+        pending = {pool.submit(visit, cid, top_result): cid for cid in src.get_child_ids(top_id)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                cid = pending.pop(future)
+                try:
+                    result, child_ids = future.result()
+                except Exception as e:
+                    errors[cid] = e
+                    continue
+                for gcid in child_ids:
+                    pending[pool.submit(visit, gcid, result)] = gcid
+    return errors
+
+def walk_bottomup(src, top_id, task, max_workers=8):
+    # Run task(page_id) for every descendant of top_id on a pool of max_workers threads.
+    # A page runs only after all of its children have finished (whether or not they failed).
+    # The tree is listed first, one level at a time, from src (an SbSession or a ReleaseSnapshot).
+    # Returns {page ID: exception} for the pages that failed.
+    errors = {}
+    task = _with_caller(task)
+    get_child_ids = _with_caller(src.get_child_ids)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # List the tree: {page ID: parent ID} and the number of children still to run for each page
+        parents = {}
+        remaining = {}
+        level = [top_id]
+        while level:
+            next_level = []
+            for pid, child_ids in zip(level, pool.map(get_child_ids, level)):
+                remaining[pid] = len(child_ids)
+                for cid in child_ids:
+                    parents[cid] = pid
+                next_level += child_ids
+            level = next_level
+        # Run the pages without children, then each parent once its last child is done
+        pending = {pool.submit(task, pid): pid for pid, ct in remaining.items() if ct == 0 and pid != top_id}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pid = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    errors[pid] = e
+                parentid = parents[pid]
+                remaining[parentid] -= 1
+                if remaining[parentid] == 0 and parentid != top_id:
+                    pending[pool.submit(task, parentid)] = parentid
+    return errors
+
+def print_tree_errors(errors):
+    # Print the exceptions collected by walk_topdown() or walk_bottomup().
+    for pid, e in errors.items():
+        print("EXCEPTION on page {}: {}".format(pid, e))
+    if errors:
+        print("{} pages could not be processed.".format(len(errors)))
+
+def delete_all_children(sb, parentid, verbose=False, snapshot=None, batch_size=1000, timeout=60):
+    # Delete all SB items that are descendants of the input page.
+    # The IDs come from a ReleaseSnapshot (loaded here with titles only if none is given) and are
+    # deleted deepest first, batch_size per delete_items() request, so no page is deleted before its children.
+    # Then waits, with backoff, up to timeout seconds for the pages to disappear from SB searches.
     exit_message = "Not sure if the process completed..."
-    cids = sb.get_child_ids(parentid)
-    for cid in cids:
+    if snapshot is None:
+        snapshot = ReleaseSnapshot.load(sb, parentid, fields=['title', 'parentId'], verbose=verbose)
+    ptitle = snapshot.get_item(parentid)['title']
+    ids_bottomup = [pid for level in reversed(snapshot.levels(parentid)[1:]) for pid in level]
+    for i in range(0, len(ids_bottomup), batch_size):
         try:
-            delete_all_children(sb, cid)
+            sb.delete_items(ids_bottomup[i:i + batch_size])
         except Exception as e:
             print("EXCEPTION: {}".format(e))
-    sb.delete_items(cids)
-    ptitle = sb.get_item(parentid)['title']
-    # Wait up to 5 seconds for the child items to be deleted
-    start = datetime.now()
-    duration = 0
-    while duration < 6:
-        duration = (datetime.now() - start).seconds
-        if len(sb.get_child_ids(parentid)) < 1:
-            exit_message = "DELETED: all child items from parent page '{}.'".format(ptitle)
-            break
+    for cid in snapshot.get_child_ids(parentid):
+        snapshot.remove(cid)
+    if verbose:
+        print("Requested deletion of {} pages below '{}'.".format(len(ids_bottomup), trunc(ptitle)))
+    # Wait for the deleted items to drop out of SB searches
+    remaining, ct_checks, secs = poll_with_backoff(lambda: sb.get_ancestor_ids(parentid), timeout)
+    if not remaining:
+        exit_message = "DELETED: all child items from parent page '{}.'".format(ptitle)
+    else:
+        exit_message = "{} pages below '{}' still show up in SB after {:.0f} seconds.".format(len(remaining), ptitle, secs)
     return(exit_message)
 
 def remove_all_child_pages(useremail=False, landing_link=False):
@@ -1272,61 +2816,112 @@ def check_fields3(sb, item, qcfields, verbose=False):
             print("{}: {}".format(f, len(item[f])))
     return item['id']
 
-def check_fields2_topdown(sb, top_id, qcfields, deficient_pages=[], verbose=False):
+def check_fields2_topdown(sb, top_id, qcfields, deficient_pages=None, verbose=False, snapshot=None):
     # Given an SB ID, pass on selected fields to all descendants; doesn't look for parents
-    for cid in sb.get_child_ids(top_id):
-        citem = sb.get_item(cid)
+    # See qc_report() to check a loaded ReleaseSnapshot without printing every page.
+    if deficient_pages is None:
+        deficient_pages = []
+    src = snapshot if snapshot is not None else sb
+    for cid in src.get_child_ids(top_id):
+        citem = src.get_item(cid)
         deficient = check_fields2(sb, citem, qcfields, verbose)
         deficient_pages.append(deficient)
         try:
-            deficient_pages = check_fields2_topdown(sb, cid, qcfields, deficient_pages, verbose)
+            deficient_pages = check_fields2_topdown(sb, cid, qcfields, deficient_pages, verbose, snapshot)
         except Exception as e:
             print("EXCEPTION: {}".format(e))
     return deficient_pages
 
-def inherit_topdown(sb, top_id, parent_inherits, child_inherits, verbose=False):
+qc_columns = ['id', 'title', 'field', 'expected', 'actual']
+
+def qc_report(snapshot, qcfieldsdict, top_id=None):
+    # Check every page below top_id in a ReleaseSnapshot against qcfieldsdict, as check_fields2() does:
+    # {field: number of entries the field should have; 0 if the field should be missing or empty}.
+    # Nothing is requested from SB. Returns one row per failed check: {id, title, field, expected, actual},
+    # where actual is the number of entries (0 if the field is missing).
+    if snapshot.fields is not None:
+        unloaded = [f for f in qcfieldsdict if not f in snapshot.fields]
+        if unloaded:
+            raise ValueError("Fields {} were not loaded in the snapshot, so they cannot be checked.".format(unloaded))
+    rows = []
+    for pid in snapshot.descendants(top_id):
+        item = snapshot.items[pid]
+        for field, expected in qcfieldsdict.items():
+            actual = len(item[field]) if field in item and item[field] is not None else 0
+            if not actual == expected:
+                rows.append({'id': pid, 'title': item.get('title'), 'field': field, 'expected': expected, 'actual': actual})
+    return rows
+
+def save_qc_report(rows, fname):
+    # Save qc_report() rows as CSV or, if fname ends with .json, as JSON.
+    if fname.lower().endswith('.json'):
+        with open(fname, 'w') as f:
+            json.dump(rows, f, indent=1)
+    else:
+        with open(fname, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=qc_columns)
+            writer.writeheader()
+            writer.writerows(rows)
+    return fname
+
+def print_qc_report(rows, verbose=False):
+    pages = set(row['id'] for row in rows)
+    if verbose:
+        for row in rows:
+            print("Page '{title}' ({id}): field '{field}' has {actual} entries, expected {expected}.".format(**row))
+    print("QA: {} pages with {} failed checks.".format(len(pages), len(rows)))
+
+def inherit_topdown(sb, top_id, parent_inherits, child_inherits, verbose=False, top_item=None, snapshot=None, max_workers=1):
     # Given an SB ID, pass on selected fields to all descendants
-    item = sb.get_item(top_id)
-    for cid in sb.get_child_ids(top_id):
-        citem = sb.get_item(cid)
+    # Each page is fetched once and passed down as the parent of its children.
+    # With a ReleaseSnapshot, pages are read from the snapshot and the updated items are put back in it.
+    # Pages that could not be updated are printed with their exceptions (see walk_topdown()).
+    # Only children whose inherited fields differ from their parent's are written (see plan_inheritance()).
+    src = snapshot if snapshot is not None else sb
+    if snapshot is not None and snapshot.fields is not None:
+        unloaded = [f for f in set(parent_inherits) | set(child_inherits) if not f in snapshot.fields and not f in pseudo_fields]
+        if unloaded:
+            raise ValueError("Fields {} were not loaded in the snapshot, so they cannot be inherited from it.".format(unloaded))
+    if not top_item:
+        top_item = src.get_item(top_id)
+    def inherit(cid, parent_item):
+        citem = src.get_item(cid)
         # Pass on fields to the next generation
         if not citem['hasChildren']: # child_inherits fields to youngest generation
-            inherit_SBfields(sb, citem, child_inherits, verbose)
+            citem = inherit_SBfields(sb, citem, child_inherits, verbose, parent_item=parent_item)
         else: # parent_inherits fields to all pages
-            inherit_SBfields(sb, citem, parent_inherits, verbose)
-        # Move to the next generation
-        try:
-            inherit_topdown(sb, cid, parent_inherits, child_inherits, verbose)
-        except Exception as e:
-            print("EXCEPTION: {}".format(e))
+            citem = inherit_SBfields(sb, citem, parent_inherits, verbose, parent_item=parent_item)
+        if snapshot is not None:
+            snapshot.add(citem)
+        return citem
+    errors = walk_topdown(src, top_id, inherit, max_workers, top_result=top_item)
+    print_tree_errors(errors)
     return True
 
-def apply_topdown(sb, top_id, function, verbose=False):
+def apply_topdown(sb, top_id, function, verbose=False, snapshot=None, max_workers=1):
     # Given an SB ID, do function to all descendants; doesn't look for parents
-    #FIXME: does it work to simply use function name as argument?
-    for cid in sb.get_child_ids(top_id):
-        citem = sb.get_item(cid)
+    # Pages where function failed are printed with their exceptions.
+    src = snapshot if snapshot is not None else sb
+    def apply(cid, parent_result):
+        citem = src.get_item(cid)
         if verbose:
-            print('Applying {} to page "{}"'.format(function, citem['title']))
+            print('Applying {} to page "{}"'.format(function.__name__, citem['title']))
         function(sb, citem)
-        try:
-            apply_topdown(sb, cid, function)
-        except Exception as e:
-            print("EXCEPTION: {}".format(e))
+    errors = walk_topdown(src, top_id, apply, max_workers)
+    print_tree_errors(errors)
     return True
 
-def apply_bottomup(sb, top_id, function, verbose=False):
-    # Given an SB ID, do function to all ancestors; doesn't look for children
-    #FIXME: does it work to simply use function name as argument?
-    for cid in sb.get_child_ids(top_id):
-        try:
-            apply_bottomup(sb, cid, function, verbose)
-        except Exception as e:
-            print("EXCEPTION: {}".format(e))
-        citem = sb.get_item(cid)
+def apply_bottomup(sb, top_id, function, verbose=False, snapshot=None, max_workers=1):
+    # Given an SB ID, do function to all descendants, children before parents; doesn't include top_id
+    # Pages where function failed are printed with their exceptions.
+    src = snapshot if snapshot is not None else sb
+    def apply(cid):
+        citem = src.get_item(cid)
         if verbose:
-            print('Applying {} to page "{}"'.format(function, citem['title']))
+            print('Applying {} to page "{}"'.format(function.__name__, citem['title']))
         function(sb, citem)
+    errors = walk_bottomup(src, top_id, apply, max_workers)
+    print_tree_errors(errors)
     return True
 
 def restore_original_xmls(parentdir):
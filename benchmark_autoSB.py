@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark_autoSB.py
+
+OVERVIEW: Time each sb_automation.py stage on a synthetic data release.
+
+Builds a directory tree of FGDC XMLs, shapefiles and browse graphics, then runs
+the sb_automation.py stages against an in-memory ScienceBase stand-in
+(fakeSB.FakeSbSession) and records wall time, ScienceBase request counts and
+peak Python memory for each stage.
+
+Example:
+    python benchmark_autoSB.py --depth 2 --fanout 5 --latency 0.02 --json bench.json
+"""
+#%% Import packages
+import os
+import sys
+import glob
+import json
+import shutil
+import struct
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+try:
+    sb_auto_dir = os.path.dirname(os.path.realpath(__file__))
+except:
+    sb_auto_dir = os.path.dirname(os.path.realpath('benchmark_autoSB.py'))
+sys.path.append(sb_auto_dir) # Add the script location to the system path just to make sure this works.
+from autoSB import *
+from fakeSB import FakeSbSession
+
+stages = ['rename_dirs_from_xmls', 'setup_subparents', 'update_all_xmls', 'uploads',
+          'update_all_browse_graphics', 'upload_all_updated_xmls', 'inherit_topdown', 'set_parent_extent']
+# Alternatives that can be named with --stages
+optional_stages = ['set_extent_from_xmls']
+
+fgdc_template = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata>
+  <idinfo>
+    <citation><citeinfo>
+      <origin>U.S. Geological Survey</origin>
+      <pubdate>2018</pubdate>
+      <title>{title}</title>
+      <edition>1.0</edition>
+      <geoform>vector digital data</geoform>
+      <serinfo><sername>data release</sername><issue>DOI:XXXXX</issue></serinfo>
+      <onlink>https://doi.org/XXXXX</onlink>
+      <onlink>https://www.sciencebase.gov/catalog/item/XXXXX</onlink>
+      <lworkcit><citeinfo>
+        <origin>U.S. Geological Survey</origin>
+        <pubdate>2018</pubdate>
+        <title>Synthetic data release</title>
+        <serinfo><sername>data release</sername><issue>DOI:XXXXX</issue></serinfo>
+        <onlink>https://dx.doi.org/XXXXX</onlink>
+        <onlink>https://www.sciencebase.gov/catalog/item/XXXXX</onlink>
+      </citeinfo></lworkcit>
+    </citeinfo></citation>
+    <descript>
+      <abstract>Synthetic dataset {title} for benchmarking. {padding}</abstract>
+      <purpose>Benchmarking.</purpose>
+    </descript>
+    <timeperd><timeinfo><sngdate><caldate>2018</caldate></sngdate></timeinfo><current>ground condition</current></timeperd>
+    <spdom><bounding>
+      <westbc>{west}</westbc><eastbc>{east}</eastbc><northbc>{north}</northbc><southbc>{south}</southbc>
+    </bounding></spdom>
+    <browse><browsen>{browse}</browsen><browsed>Browse graphic of {title}</browsed><browset>PNG</browset></browse>
+  </idinfo>
+  <eainfo><detailed><attr><attrlabl>FID</attrlabl>
+    <attrdomv><udom>Sequential unique whole numbers that are automatically generated.</udom></attrdomv>
+  </attr></detailed></eainfo>
+  <distinfo><stdorder><digform>
+    <digtinfo><formname>Shapefile</formname></digtinfo>
+    <digtopt><onlinopt><computer><networka>
+      <networkr>https://www.sciencebase.gov/catalog/item/XXXXX</networkr>
+      <networkr>https://www.sciencebase.gov/catalog/file/get/XXXXX</networkr>
+      <networkr>https://doi.org/XXXXX</networkr>
+    </networka></computer><accinstr>XXXXX</accinstr></onlinopt></digtopt>
+  </digform><fees>None</fees></stdorder></distinfo>
+  <metainfo><metd>20180101</metd></metainfo>
+</metadata>
+"""
+
+#%% Synthetic data release
+def write_shp(shp_file, bbox, size=0):
+    # Write a shapefile main file with a valid 100-byte header (polyline type) padded to size bytes.
+    size = max(size, 100)
+    with open(shp_file, 'wb') as f:
+        f.write(struct.pack('>7i', 9994, 0, 0, 0, 0, 0, size // 2))
+        f.write(struct.pack('<2i', 1000, 3))
+        f.write(struct.pack('<4d', *bbox))
+        f.write(struct.pack('<4d', 0, 0, 0, 0))
+        f.write(b'\0' * (size - 100))
+
+def make_release(parentdir, depth=2, fanout=3, xmls_per_folder=1, fgdc_kb=10, data_kb=100, seed=0):
+    # Build a release tree under parentdir: depth levels of fanout folders; the bottom folders hold
+    # xmls_per_folder datasets (FGDC XML of about fgdc_kb, .shp and .dbf of data_kb each, browse PNG).
+    rand = random.Random(seed)
+    os.makedirs(parentdir, exist_ok=True)
+    # Folder names are unique across the tree (folder 1, folder 1-2, ...), like page titles in a real release.
+    dirs = [os.path.join(parentdir, 'folder {}'.format(i + 1)) for i in range(fanout)] if depth else [parentdir]
+    for level in range(1, depth):
+        dirs = [os.path.join(d, '{}-{}'.format(os.path.basename(d), i + 1)) for d in dirs for i in range(fanout)]
+    ct = 0
+    for datadir in dirs:
+        os.makedirs(datadir, exist_ok=True)
+        for i in range(xmls_per_folder):
+            ct += 1
+            title = os.path.basename(datadir) if i == 0 else '{} {}'.format(os.path.basename(datadir), i + 1)
+            name = 'dataset{:05d}'.format(ct)
+            west = rand.uniform(-125, -70)
+            south = rand.uniform(25, 48)
+            bbox = (west, south, west + rand.uniform(0.01, 1), south + rand.uniform(0.01, 1))
+            padding = 'x' * max(fgdc_kb * 1024 - len(fgdc_template), 0)
+            with open(os.path.join(datadir, name + '.shp.xml'), 'w') as f:
+                f.write(fgdc_template.format(title=title, padding=padding, west=bbox[0], south=bbox[1],
+                                             east=bbox[2], north=bbox[3], browse=name + '_browse.png'))
+            write_shp(os.path.join(datadir, name + '.shp'), bbox, data_kb * 1024)
+            with open(os.path.join(datadir, name + '.dbf'), 'wb') as f:
+                f.write(b'\0' * (data_kb * 1024))
+            with open(os.path.join(datadir, name + '_browse.png'), 'wb') as f:
+                f.write(b'\x89PNG' + b'\0' * 1024)
+    return(ct)
+
+#%% Run stages
+def run_stages(parentdir, sb, landing_id, run=stages, max_workers=1, max_connections=1, verbose=False, max_processes=1):
+    # Run the sb_automation.py stages in order and return [{stage, seconds, requests, peak_MB, calls}].
+    new_values = {'landing_id': landing_id, 'doi': '10.5066/P9XXXXXX', 'pubdate': '2019',
+                  'find_and_replace': {'dx.doi.org': 'doi.org'}}
+    inherits = ['citation', 'contacts', 'body', 'webLinks', 'relatedItems']
+    state = {'dict_DIRtoID': {}, 'valid_ids': None, 'xml_extents': {}, 'resolver': None}
+    def uploads():
+        for xml_file in glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True):
+            datapageid = get_pageid_from_xmlpath(xml_file, sb=sb, dict_DIRtoID=state['dict_DIRtoID'], valid_ids=state['valid_ids'], parentdir=parentdir, resolver=state['resolver'])
+            data_item = sb.get_item(datapageid)
+            upload_files(sb, data_item, xml_file, replace=True)
+    def setup():
+        state['dict_DIRtoID'] = setup_subparents(sb, parentdir, landing_id, False, verbose=verbose)
+        state['resolver'] = PageIdResolver(sb, parentdir, landing_id, state['dict_DIRtoID']).load()
+        state['valid_ids'] = state['resolver'].valid_ids
+    actions = {
+        'rename_dirs_from_xmls': lambda: rename_dirs_from_xmls(parentdir),
+        'setup_subparents': setup,
+        'update_all_xmls': lambda: update_all_xmls(parentdir, new_values, sb, state['dict_DIRtoID'], verbose=verbose, extents=state['xml_extents'], resolver=state['resolver'], max_processes=max_processes),
+        'uploads': uploads,
+        'update_all_browse_graphics': lambda: update_all_browse_graphics(sb, parentdir, landing_id, state['valid_ids'], resolver=state['resolver']),
+        'upload_all_updated_xmls': lambda: upload_all_updated_xmls(sb, parentdir, state['valid_ids'], max_connections=max_connections, resolver=state['resolver']),
+        'inherit_topdown': lambda: inherit_topdown(sb, landing_id, inherits, inherits, max_workers=max_workers),
+        'set_parent_extent': lambda: set_parent_extent(sb, landing_id, verbose=verbose),
+        'set_extent_from_xmls': lambda: set_extent_from_xmls(sb, parentdir, state['dict_DIRtoID'], state['xml_extents'], verbose=verbose),
+        }
+    results = []
+    for stage in run:
+        before = dict(sb.calls)
+        tracemalloc.start()
+        start = datetime.now()
+        actions[stage]()
+        flush_writes(sb)
+        seconds = (datetime.now() - start).total_seconds()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        calls = {m: ct - before.get(m, 0) for m, ct in sb.calls.items() if ct - before.get(m, 0)}
+        results.append({'stage': stage, 'seconds': seconds, 'requests': sum(calls.values()),
+                        'peak_MB': peak / 1e6, 'calls': calls})
+    return(results)
+
+def print_results(results):
+    print('\n{:<28} {:>10} {:>10} {:>10}'.format('stage', 'seconds', 'requests', 'peak MB'))
+    for r in results:
+        print('{:<28} {:>10.2f} {:>10} {:>10.1f}'.format(r['stage'], r['seconds'], r['requests'], r['peak_MB']))
+    print('{:<28} {:>10.2f} {:>10}'.format('total', sum(r['seconds'] for r in results), sum(r['requests'] for r in results)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time sb_automation.py stages on a synthetic data release.')
+    parser.add_argument('--depth', type=int, default=2, help='levels of folders below the top directory')
+    parser.add_argument('--fanout', type=int, default=3, help='sub-folders per folder')
+    parser.add_argument('--xmls-per-folder', type=int, default=1, help='datasets in each bottom folder')
+    parser.add_argument('--fgdc-kb', type=int, default=10, help='approximate size of each FGDC XML')
+    parser.add_argument('--data-kb', type=int, default=100, help='size of each .shp and .dbf file')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every ScienceBase call')
+    parser.add_argument('--index-delay', type=float, default=0.0, help='seconds before new pages show up in searches')
+    parser.add_argument('--upload-rate', type=float, default=None, help='upload bandwidth in bytes per second')
+    parser.add_argument('--workers', type=int, default=1, help='max_workers for the tree operations')
+    parser.add_argument('--processes', type=int, default=1, help='max_processes for update_all_xmls')
+    parser.add_argument('--connections', type=int, default=1, help='max_connections for concurrent fetches')
+    parser.add_argument('--stages', nargs='+', default=stages, choices=stages + optional_stages, help='stages to run, in order')
+    parser.add_argument('--dir', default=None, help='where to build the release (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic release afterward')
+    parser.add_argument('--json', default=None, help='also write the results to this JSON file')
+    parser.add_argument('--api-report', action='store_true', help='also print ScienceBase calls by autoSB function')
+    parser.add_argument('--defer-writes', action='store_true', help='write each page once per stage (WriteBackSbSession)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    workdir = args.dir or tempfile.mkdtemp(prefix='autoSB_bench_')
+    parentdir = os.path.join(workdir, 'release')
+    ct = make_release(parentdir, args.depth, args.fanout, args.xmls_per_folder, args.fgdc_kb, args.data_kb, args.seed)
+    print('Built synthetic release with {} XMLs in {}'.format(ct, parentdir))
+
+    sb = FakeSbSession(latency=args.latency, upload_rate=args.upload_rate, index_delay=args.index_delay, seed=args.seed)
+    landing_id = sb.add_item({'id': 'landing0000000000000000', 'title': 'Synthetic data release',
+                              'citation': 'Synthetic citation', 'body': 'Synthetic abstract',
+                              'contacts': [{'name': 'U.S. Geological Survey', 'type': 'Point of Contact'}],
+                              'webLinks': [{'uri': 'https://doi.org/10.5066/P9XXXXXX', 'title': 'DOI'}]})['id']
+    adopt_session(sb)
+    if args.api_report:
+        sb = wrap_session(InstrumentedSbSession)
+    if args.defer_writes:
+        sb = wrap_session(WriteBackSbSession)
+    results = run_stages(parentdir, sb, landing_id, args.stages, args.workers, args.connections, max_processes=args.processes)
+    print_results(results)
+    if args.api_report:
+        sb.print_report()
+    if args.json:
+        params = {k: v for k, v in vars(args).items() if not k in ('json', 'dir', 'keep')}
+        with open(args.json, 'w') as f:
+            json.dump({'params': params, 'xml_count': ct, 'results': results}, f, indent=2)
+        print('Saved results to {}'.format(args.json))
+    if not args.keep and not args.dir:
+        shutil.rmtree(workdir)
+    return(results)
+
+if __name__ == '__main__':
+    main()
@@ -83,9 +83,22 @@ delete_all_subpages = False # True to delete all child pages before running. Not
 update_XML          = True # False to save time if XML already has most up-to-date values.
 update_data         = False # False to save time if up-to-date data files have already been uploaded.
 update_extent       = False
+extent_from_xml     = False # True to set page extents from the local shapefile headers and XML bounding coordinates instead of reading them from SB.
 verbose             = True
+cache_items         = False # True to keep fetched SB items in memory (LRU) instead of requesting the same page again.
+cache_maxsize       = 5000 # Maximum number of items held when cache_items is True.
+max_workers         = 1 # Number of pages worked on at once in tree operations (inheritance, extents). 1 to work on one page at a time.
+max_processes       = 1 # Number of processes used to rewrite the XMLs (update_all_xmls). e.g. os.cpu_count() on a multi-core machine.
+max_connections     = 16 # Number of SB requests kept in flight when many pages are fetched at once. 1 to fetch one at a time.
+defer_writes        = False # True to collect the changes to each page and write them once per stage instead of after every change.
+report_api_calls    = False # True to count SB calls by function and print a summary at the end of the run.
+save_api_report     = False # True to also save that summary as api_calls.json in the stash directory.
+use_snapshot        = True # True to load the whole page tree in a few searches for the tree operations (inheritance, QA).
 # page_per_filename   = False
 
+offline_sb          = False # True to run against an in-memory stand-in for ScienceBase (fakeSB.py). Nothing is sent to SB.
+offline_latency     = 0.0 # Seconds added to each call to the stand-in when offline_sb is True.
+
 max_MBsize = 2000 # 2000 mb is the suggested threshold above which to use the large file uploader.
 start_xml_idx = 0 # 0 to perform for all XMLs. This is included in case a process does not complete. '25' to start upload at file 26.
 
@@ -109,7 +122,7 @@ find_and_replace = {'**dr_doi**': dr_doi,
 # remove_fills = {'./idinfo/crossref':['AUTHOR', 'doi.org/10.3133/ofr20171015']}
 
 # APPEND ELEMENT.
-# Add {container: new XML element} item to metadata_additions dictionary for each element to be appended to the container element. Appending will not remove any elements.
+# Add {container: new XML element} item to metadata_additions dictionary for each element to be appended to the container element. Appending will not remove any elements, and an element that is already in the container is not added again.
 # Example of a new cross reference:
 # new_crossref = """
 #     <crossref><citeinfo>
@@ -161,10 +174,6 @@ find_and_replace = {'**dr_doi**': dr_doi,
 """
 Initialize
 """
-#%% Initialize SB session
-password = getpass.getpass("ScienceBase password: ")
-sb = log_in(useremail, password)
-
 stash_dir = os.path.join(parentdir, '.assistants')
 
 #%% Find landing page
@@ -174,3 +183,13 @@ if not "landing_id" in locals():
     except:
         print("""Either the ID (landing_id) or the URL (landing_link) of the
             ScienceBase landing page must be specified in config_autoSB.py.""")
+
+#%% Initialize SB session
+if offline_sb:
+    from fakeSB import FakeSbSession
+    password = None
+    sb = adopt_session(FakeSbSession(latency=offline_latency))
+    sb.add_item({'id': landing_id, 'title': os.path.basename(parentdir)})
+else:
+    password = getpass.getpass("ScienceBase password: ")
+    sb = log_in(useremail, password)
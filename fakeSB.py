@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+"""
+fakeSB.py
+
+OVERVIEW: In-memory stand-in for sciencebasepy.SbSession so that autoSB.py and
+sb_automation.py can be run and timed without network access.
+
+FakeSbSession keeps items, parent/child links, files and facets in memory and
+implements every SbSession method that autoSB calls. Each call can be given a
+latency and an error rate to mimic the real service. Searches (get_child_ids,
+get_ancestor_ids, find_items...) only see items index_delay seconds after they
+were created or deleted, like the ScienceBase search index.
+
+Example:
+    sb = FakeSbSession(latency=0.05, error_rate=0.01, seed=1)
+    landing_item = sb.add_item({'id': landing_id, 'title': 'Landing page'})
+"""
+#%% Import packages
+import os
+import copy
+import json
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urlencode, parse_qsl
+from lxml import etree
+
+__all__ = ['FakeSbError', 'FakeSbSession', 'content_type_from_filename']
+
+item_url = 'https://www.sciencebase.gov/catalog/item/{}'
+file_url = 'https://www.sciencebase.gov/catalog/file/get/{}/?name={}'
+shp_parts = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.sbn', '.sbx', '.shp.xml')
+
+class FakeSbError(Exception):
+    pass
+
+def content_type_from_filename(fname):
+    # Guess the contentType ScienceBase would give an uploaded file.
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == '.xml':
+        try:
+            if etree.parse(fname).getroot().tag == 'metadata':
+                return 'application/fgdc+xml'
+        except Exception:
+            pass
+        return 'application/xml'
+    types = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.gif': 'image/gif',
+             '.zip': 'application/zip', '.csv': 'text/csv', '.txt': 'text/plain', '.tif': 'image/tiff',
+             '.shp': 'application/octet-stream', '.dbf': 'application/dbf'}
+    return types.get(ext, 'application/octet-stream')
+
+def _shp_bounds(shp_file):
+    # Bounding box from the .shp header: Xmin, Ymin, Xmax, Ymax at byte 36.
+    try:
+        with open(shp_file, 'rb') as f:
+            header = f.read(100)
+        minx, miny, maxx, maxy = struct.unpack('<4d', header[36:68])
+        return {'minX': minx, 'minY': miny, 'maxX': maxx, 'maxY': maxy}
+    except Exception:
+        return None
+
+def _scrape_fgdc(xml_file):
+    # Fields that ScienceBase populates from an uploaded FGDC XML.
+    fields = {}
+    try:
+        root = etree.parse(xml_file).getroot()
+    except Exception:
+        return fields
+    for field, path in [('title', './idinfo/citation/citeinfo/title'), ('body', './idinfo/descript/abstract'),
+                        ('purpose', './idinfo/descript/purpose')]:
+        elem = root.find(path)
+        if elem is not None and elem.text:
+            fields[field] = elem.text.strip()
+    try:
+        bounding = root.find('./idinfo/spdom/bounding')
+        fields['spatial'] = {'boundingBox': {
+            'minX': float(bounding.findtext('westbc')), 'maxX': float(bounding.findtext('eastbc')),
+            'minY': float(bounding.findtext('southbc')), 'maxY': float(bounding.findtext('northbc'))}}
+    except Exception:
+        pass
+    return fields
+
+
+class FakeSbSession(object):
+    # In-memory stand-in for sciencebasepy.SbSession.
+    # - latency: seconds added to every call, or {method name: seconds}; jitter: +/- fraction of the latency.
+    # - upload_rate: bytes per second added to uploads (None for no extra time).
+    # - error_rate: probability that a call raises FakeSbError, or {method name: probability}.
+    # - index_delay: seconds before created/deleted items show up in searches.
+    # - max_item_count: page size for searches, as in SbSession.
+    # Calls are counted by method name in self.calls.
+    def __init__(self, latency=0.0, jitter=0.0, upload_rate=None, error_rate=0.0, index_delay=0.0,
+                 max_item_count=1000, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.upload_rate = upload_rate
+        self.error_rate = error_rate
+        self.index_delay = index_delay
+        self._max_item_count = max_item_count
+        self.calls = Counter()
+        self.items = {}
+        self._indexed_at = {} # {ID: time the item shows up in searches}
+        self._deleted_at = {} # {ID: time the item stops showing up in searches}
+        self._deleted_items = {}
+        self._child_ids = {} # {parent ID: set of child IDs}
+        self._username = None
+        self._random = random.Random(seed)
+        self._lock = threading.RLock()
+
+    #%% Latency and errors
+    def _call(self, method, nbytes=0):
+        with self._lock:
+            self.calls[method] += 1
+            latency = self.latency.get(method, 0.0) if isinstance(self.latency, dict) else self.latency
+            if self.jitter:
+                latency *= 1 + self._random.uniform(-self.jitter, self.jitter)
+            error_rate = self.error_rate.get(method, 0.0) if isinstance(self.error_rate, dict) else self.error_rate
+            fail = error_rate and self._random.random() < error_rate
+        if self.upload_rate and nbytes:
+            latency += nbytes / float(self.upload_rate)
+        if latency > 0:
+            time.sleep(latency)
+        if fail:
+            raise FakeSbError('Simulated ScienceBase error in {}()'.format(method))
+
+    def call_count(self):
+        return sum(self.calls.values())
+
+    #%% Helpers
+    def add_item(self, item_json):
+        # Put an item in the store without counting a call, e.g. to set up the landing page.
+        with self._lock:
+            item = self._new_item(item_json)
+            self._indexed_at[item['id']] = 0
+            return copy.deepcopy(item)
+
+    def _new_item(self, item_json):
+        item = copy.deepcopy(item_json)
+        item.setdefault('id', uuid.uuid4().hex[:24])
+        if item['id'] in self.items:
+            raise FakeSbError('Item {} already exists'.format(item['id']))
+        if item.get('parentId') and not item['parentId'] in self.items:
+            raise FakeSbError('Parent item {} not found'.format(item['parentId']))
+        item.setdefault('title', '')
+        item['link'] = {'rel': 'self', 'url': item_url.format(item['id'])}
+        self.items[item['id']] = item
+        self._child_ids.setdefault(item.get('parentId'), set()).add(item['id'])
+        self._indexed_at[item['id']] = time.time() + self.index_delay
+        return item
+
+    def _get(self, itemid):
+        if not itemid in self.items:
+            raise FakeSbError('Item {} not found'.format(itemid))
+        return self.items[itemid]
+
+    def _children(self, parentid):
+        return self._child_ids.get(parentid, set())
+
+    def _with_has_children(self, item):
+        # Copy of the stored item as SB returns it: empty files and facets are left out.
+        item = copy.deepcopy(item)
+        for field in ('files', 'facets'):
+            if field in item and not item[field]:
+                del item[field]
+        item['hasChildren'] = len(self._children(item['id'])) > 0
+        return item
+
+    def _merge(self, item_json):
+        # Update the stored item with the given fields; None removes a field.
+        item = self._get(item_json['id'])
+        if item_json.get('parentId') and item_json['parentId'] != item.get('parentId'):
+            self._child_ids[item.get('parentId')].discard(item['id'])
+            self._child_ids.setdefault(item_json['parentId'], set()).add(item['id'])
+        for field, value in item_json.items():
+            if field in ('id', 'link', 'hasChildren'):
+                continue
+            if value is None:
+                item.pop(field, None)
+            else:
+                item[field] = copy.deepcopy(value)
+        return item
+
+    def _visible(self, itemid, now):
+        if itemid in self._deleted_at:
+            return now < self._deleted_at[itemid]
+        return itemid in self.items and self._indexed_at.get(itemid, 0) <= now
+
+    def _search_pool(self):
+        # Items as seen by the search index: recently deleted items are still listed.
+        now = time.time()
+        pool = dict(self.items)
+        pool.update(self._deleted_items)
+        return [item for itemid, item in pool.items() if self._visible(itemid, now)]
+
+    def _ancestor_ids(self, item, pool):
+        chain = []
+        parentid = item.get('parentId')
+        while parentid in pool:
+            chain.append(parentid)
+            parentid = pool[parentid].get('parentId')
+        return chain
+
+    #%% Session
+    def login(self, username, password):
+        self._call('login')
+        self._username = username
+        return self
+
+    def loginc(self, username, tries=3):
+        return self.login(username, None)
+
+    def is_logged_in(self):
+        self._call('is_logged_in')
+        return True
+
+    def logout(self):
+        self._username = None
+
+    def ping(self):
+        self._call('ping')
+        return {'result': {'statusCode': 200}}
+
+    def get_session_info(self):
+        self._call('get_session_info')
+        return {'isLoggedIn': True, 'username': self._username}
+
+    #%% Items
+    def get_item(self, itemid, params=None):
+        self._call('get_item')
+        with self._lock:
+            item = self._with_has_children(self._get(itemid))
+        if params and 'fields' in params:
+            fields = params['fields'].split(',')
+            item = {k: v for k, v in item.items() if k in fields or k in ('id', 'title', 'link')}
+        return item
+
+    def create_item(self, item_json):
+        self._call('create_item')
+        with self._lock:
+            return self._with_has_children(self._new_item(item_json))
+
+    def create_items(self, items_json):
+        self._call('create_items')
+        with self._lock:
+            return [self._with_has_children(self._new_item(item_json)) for item_json in items_json]
+
+    def update_item(self, item_json):
+        self._call('update_item')
+        with self._lock:
+            return self._with_has_children(self._merge(item_json))
+
+    def updateSbItem(self, item_json):
+        return self.update_item(item_json)
+
+    def update_items(self, items_json):
+        self._call('update_items')
+        with self._lock:
+            return [self._with_has_children(self._merge(item_json)) for item_json in items_json]
+
+    def delete_item(self, item_json):
+        self._call('delete_item')
+        with self._lock:
+            self._delete(item_json['id'])
+        return True
+
+    def delete_items(self, itemIds):
+        # One call per max_item_count IDs, as in SbSession.
+        for i in range(0, len(itemIds), self._max_item_count):
+            self._call('delete_items')
+            with self._lock:
+                for itemid in itemIds[i:i + self._max_item_count]:
+                    self._delete(itemid)
+        return True
+
+    def _delete(self, itemid):
+        item = self._get(itemid)
+        if self._children(itemid):
+            raise FakeSbError('Item {} has children and cannot be deleted'.format(itemid))
+        self._deleted_items[itemid] = self.items.pop(itemid)
+        self._deleted_at[itemid] = time.time() + self.index_delay
+        self._child_ids[item.get('parentId')].discard(itemid)
+
+    #%% Searches
+    def find_items(self, params):
+        self._call('find_items')
+        params = dict(params)
+        with self._lock:
+            pool = self._search_pool()
+            by_id = {item['id']: item for item in pool}
+            filters = params.get('filter', [])
+            for fltr in (filters if type(filters) is list else [filters]):
+                key, _, value = fltr.partition('=')
+                if key in ('parentId', 'parentIdExcludingLinks'):
+                    pool = [item for item in pool if item.get('parentId') == value]
+                elif key in ('ancestors', 'ancestorsExcludingLinks'):
+                    pool = [item for item in pool if value in self._ancestor_ids(item, by_id)]
+            if params.get('parentId'):
+                pool = [item for item in pool if item.get('parentId') == params['parentId']]
+            if params.get('ancestors'):
+                pool = [item for item in pool if params['ancestors'] in self._ancestor_ids(item, by_id)]
+            lq = params.get('lq', '')
+            if lq.startswith('title:'):
+                title = lq[len('title:'):].strip('"')
+                pool = [item for item in pool if item.get('title') == title]
+            q = params.get('q', '')
+            if q:
+                pool = [item for item in pool if q.lower() in json.dumps(item).lower()]
+            offset = int(params.get('offset', 0))
+            size = min(int(params.get('max', 20)), self._max_item_count)
+            page = pool[offset:offset + size]
+            fields = params['fields'].split(',') if params.get('fields') else []
+            results = []
+            for item in page:
+                item = self._with_has_children(item)
+                results.append({k: v for k, v in item.items()
+                                if k in fields or k in ('id', 'title', 'link', 'hasChildren')})
+        response = {'total': len(pool), 'items': results}
+        if offset + size < len(pool):
+            next_params = dict(params, offset=offset + size)
+            response['nextlink'] = {'rel': 'next', 'url': 'fake:items?' + urlencode(next_params)}
+        return response
+
+    def next(self, items):
+        if 'nextlink' in items:
+            return self.find_items(dict(parse_qsl(items['nextlink']['url'].split('?', 1)[1])))
+        return None
+
+    def find_items_by_title(self, text):
+        return self.find_items({'q': '', 'lq': 'title:"' + text + '"'})
+
+    def find_items_by_any_text(self, text):
+        return self.find_items({'q': text})
+
+    def get_child_ids(self, parentid):
+        return self._ids_from_search({'filter': 'parentIdExcludingLinks=' + parentid, 'max': self._max_item_count})
+
+    def get_ancestor_ids(self, parentid):
+        return self._ids_from_search({'filter': 'ancestorsExcludingLinks=' + parentid, 'max': self._max_item_count})
+
+    def _ids_from_search(self, params):
+        retval = []
+        items = self.find_items(params)
+        while items and 'items' in items:
+            for item in items['items']:
+                retval.append(item['id'])
+            items = self.next(items)
+        return retval
+
+    #%% Files
+    def _file_json(self, itemid, fname, scrape_file=True):
+        content_type = content_type_from_filename(fname)
+        return {'name': os.path.basename(fname),
+                'title': '',
+                'contentType': content_type,
+                'size': os.path.getsize(fname),
+                'dateUploaded': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'originalMetadata': scrape_file and content_type == 'application/fgdc+xml',
+                'useForPreview': False,
+                'url': file_url.format(itemid, os.path.basename(fname))}
+
+    def _attach(self, item, filenames, scrape_file=True):
+        # Add the files to the stored item: shapefile parts become a facet; FGDC XMLs populate fields.
+        shp_files = {}
+        for fname in filenames:
+            lower = fname.lower()
+            part = [ext for ext in shp_parts if lower.endswith(ext)]
+            base = fname[:-len(part[0])] if part else None
+            if part and os.path.isfile(base + '.shp'):
+                shp_files.setdefault(base, []).append(fname)
+            else:
+                item.setdefault('files', []).append(self._file_json(item['id'], fname, scrape_file))
+            if scrape_file and lower.endswith('.xml') and content_type_from_filename(fname) == 'application/fgdc+xml':
+                item.update(_scrape_fgdc(fname))
+        for base, fnames in shp_files.items():
+            facet = {'className': 'gov.sciencebase.catalog.item.facet.ShapefileFacet',
+                     'name': os.path.basename(base),
+                     'files': [self._file_json(item['id'], fn, scrape_file) for fn in fnames]}
+            bbox = _shp_bounds(base + '.shp')
+            if bbox:
+                facet['boundingBox'] = bbox
+            item['facets'] = [f for f in item.get('facets', []) if f.get('name') != facet['name']] + [facet]
+        return item
+
+    def upload_file_to_item(self, item, filename, scrape_file=True):
+        return self.upload_files_and_update_item(item, [filename], scrape_file)
+
+    def upload_files_and_update_item(self, item, filenames, scrape_file=True):
+        return self.upload_files_and_upsert_item(item, filenames, scrape_file)
+
+    def upload_files_and_upsert_item(self, item, filenames, scrape_file=True):
+        self._call('upload_files_and_upsert_item', sum(os.path.getsize(fn) for fn in filenames))
+        with self._lock:
+            if 'id' in item and item['id'] in self.items:
+                stored = self._merge(item)
+            else:
+                stored = self._new_item(item)
+            return self._with_has_children(self._attach(stored, filenames, scrape_file))
+
+    def upload_file_and_create_item(self, parentid, filename, scrape_file=True):
+        return self.upload_files_and_upsert_item({'parentId': parentid}, [filename], scrape_file)
+
+    def replace_file(self, filename, item):
+        self._call('replace_file', os.path.getsize(filename))
+        with self._lock:
+            stored = self._get(item['id'])
+            name = os.path.basename(filename)
+            stored['files'] = [f for f in stored.get('files', []) if f['name'] != name]
+            return self._with_has_children(self._attach(stored, [filename]))
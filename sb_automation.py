@@ -39,6 +39,16 @@ from config_autoSB import *
 """
 sb = log_in(useremail)
 """
+# Optionally count SB calls by function; this goes directly around the session so cached reads are not counted.
+if 'report_api_calls' in locals() and report_api_calls:
+    sb = wrap_session(InstrumentedSbSession)
+    api_calls = sb
+# Optionally hold page updates and write each page once at the flush_writes() calls below.
+if 'defer_writes' in locals() and defer_writes:
+    sb = wrap_session(WriteBackSbSession)
+# Optionally put an item cache in front of the session; log_in() then returns the cached session.
+if 'cache_items' in locals() and cache_items:
+    sb = wrap_session(CachedSbSession, maxsize=cache_maxsize)
 # get JSON item for parent page
 landing_item = sb.get_item(landing_id)
 #print("CITATION: {}".format(landing_item['citation'])) # print to QC citation
@@ -110,7 +120,7 @@ if not update_subpages and not os.path.isfile(mapfile_dir2id):
 
 if update_subpages:
     print('\n---\nCreating sub-pages...')
-    dict_DIRtoID = setup_subparents(sb, parentdir, landing_id, imagefile)
+    dict_DIRtoID = setup_subparents(sb, parentdir, landing_id, imagefile, max_workers=max_workers)
     # Save dictionaries
     with open(mapfile_dir2id, 'w') as f:
         json.dump(dict_DIRtoID, f)
@@ -127,7 +137,9 @@ For each XML file in each directory, create a data page, revise the XML, and upl
 print('\n---\nWorking with XML files...')
 # Log into SB if it's timed out
 sb = log_in(useremail, password)
-valid_ids = sb.get_ancestor_ids(landing_id)
+# Index the pages below the landing page once; XMLs are matched to their pages from it for the rest of the run.
+resolver = PageIdResolver(sb, parentdir, landing_id, dict_DIRtoID).load()
+valid_ids = resolver.valid_ids
 
 #%% Work with XMLs
 # Optionally remove or restore original XML files.
@@ -147,8 +159,10 @@ else:
     new_values['doi'] = get_DOI_from_item(flexibly_get_item(sb, landing_id))
 
 # Optionally update all XML files from SB values
+xml_extents = {} # {xml_file: bbox}, collected while the XMLs are updated
+changed_ids = [] # data pages changed in this run, so that only the extents above them are recomputed
 if update_XML:
-    update_all_xmls(parentdir, new_values, sb, dict_DIRtoID, verbose=True)
+    update_all_xmls(parentdir, new_values, sb, dict_DIRtoID, verbose=True, extents=xml_extents, resolver=resolver, max_processes=max_processes)
 
 #%% Upload data
 if update_data:
@@ -158,11 +172,14 @@ if update_data:
     cnt = 0
     xmllist = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
     xmllist = xmllist[start_xml_idx:]
+    # With the item cache on, get all the data pages at once rather than one per loop.
+    if hasattr(sb, 'cache_stats') and max_connections > 1:
+        prefetch_items(sb, [resolver.resolve(xml_file) for xml_file in xmllist], max_connections)
     for xml_file in xmllist:
         cnt += 1
         print("File {}: {}".format(cnt + start_xml_idx, xml_file))
         # Get SB page ID from the XML
-        datapageid = get_pageid_from_xmlpath(xml_file, sb=sb, dict_DIRtoID=dict_DIRtoID, valid_ids=valid_ids, parentdir=parentdir, verbose=False)
+        datapageid = resolver.resolve(xml_file)
         # Log into SB if it's timed out
         sb = log_in(useremail, password)
         data_item = sb.get_item(datapageid)
@@ -187,8 +204,11 @@ if update_data:
         if verbose:
             now_str = datetime.now().strftime("%H:%M:%S on %Y-%m-%d")
             print('Completed {} out of {} total xml files at {}.\n'.format(start_xml_idx+cnt, start_xml_idx+len(xmllist), now_str))
+        # Write this page's pending changes now, so that a run restarted from start_xml_idx loses nothing
+        flush_writes(sb, itemids=[data_item['id']])
         # store values in dictionaries
         dict_DIRtoID[xml_file] = data_item['id']
+        changed_ids.append(data_item['id'])
 
 print("\n---\nRunning universal updates (browse graphics and udpated XMls)...")
 
@@ -199,20 +219,39 @@ if add_preview_image_to_all:
 #%% Update SB preview image from the uploaded files.
 if update_XML:
     sb = log_in(useremail, password)
-    update_all_browse_graphics(sb, parentdir, landing_id, valid_ids)
+    update_all_browse_graphics(sb, parentdir, landing_id, valid_ids, resolver=resolver)
 
 #%% Check for and upload XMLs that have been modified since last upload.
 sb = log_in(useremail, password)
-upload_all_updated_xmls(sb, parentdir, valid_ids)
+changed_ids.extend(upload_all_updated_xmls(sb, parentdir, valid_ids, max_connections=max_connections, resolver=resolver))
+
+#%% Load the page tree once for the tree operations below
+flush_writes(sb, verbose=verbose) # the snapshot is read by search, so pending changes must be on SB first
+if 'use_snapshot' in locals() and use_snapshot:
+    snapshot = ReleaseSnapshot.load(sb, landing_id, verbose=verbose)
+else:
+    snapshot = None
 
 #%% Pass down fields from parents to children
 print("\n---\nPassing down fields from parents to children...")
-inherit_topdown(sb, landing_id, subparent_inherits, data_inherits, verbose=verbose)
+inherit_topdown(sb, landing_id, subparent_inherits, data_inherits, verbose=verbose, snapshot=snapshot, max_workers=max_workers)
+flush_writes(sb, verbose=verbose)
 
 #%% BOUNDING BOX
 if update_extent:
     print("\nGetting extent of child data for parent pages...")
-    set_parent_extent(sb, landing_id, verbose=verbose)
+    # With extents saved from a previous run, only the parents above pages changed in this run are recomputed.
+    mapfile_extents = os.path.join(stash_dir, 'extents.json')
+    extent_cache = load_extent_cache(mapfile_extents) if not update_subpages else {}
+    if 'extent_from_xml' in locals() and extent_from_xml:
+        # Shapefile headers give the extent of shapefile datasets; XMLs whose bounding differs are flagged.
+        shp_bboxes = shp_extents(parentdir, max_workers)
+        check_xml_extents(parentdir, shp_bboxes, xml_extents, verbose=verbose)
+        set_extent_from_xmls(sb, parentdir, dict_DIRtoID, xml_extents, snapshot=snapshot, extent_cache=extent_cache, verbose=verbose, shp_bboxes=shp_bboxes)
+    else:
+        set_parent_extent(sb, landing_id, verbose=verbose, snapshot=snapshot, changed_ids=changed_ids, extent_cache=extent_cache)
+    save_extent_cache(mapfile_extents, extent_cache)
+    flush_writes(sb, verbose=verbose)
 
 # Save dictionaries
 with open(mapfile_dir2id, 'w') as f:
@@ -222,7 +261,19 @@ with open(mapfile_dir2id, 'w') as f:
 if 'qcfields_dict' in locals():
     qcfields_dict = {'contacts':7, 'webLinks':0, 'facets':1}
     print('Checking that each page has: \n{}'.format(qcfields_dict))
-    pagelist = check_fields2_topdown(sb, landing_id, qcfields_dict, verbose=False)
+    if snapshot is not None: # check the loaded page tree without printing every page
+        qc_rows = qc_report(snapshot, qcfields_dict)
+        print_qc_report(qc_rows, verbose=verbose)
+        print('Saved QA report to {}'.format(save_qc_report(qc_rows, os.path.join(stash_dir, 'qc_report.csv'))))
+    else:
+        pagelist = check_fields2_topdown(sb, landing_id, qcfields_dict, verbose=False)
+
+if hasattr(sb, 'cache_stats'):
+    print('Item cache: {hits} hits, {misses} misses, {size} items held.'.format(**sb.cache_stats()))
+if 'api_calls' in locals():
+    api_calls.print_report()
+    if save_api_report:
+        print('Saved SB call report to {}'.format(api_calls.save_report(os.path.join(stash_dir, 'api_calls.json'))))
 
 now_str = datetime.now().strftime("%H:%M:%S on %m/%d/%Y")
 print('\n{}\nAll done! View the result at {}'.format(now_str, landing_link))
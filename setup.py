@@ -9,6 +9,6 @@ setup(name='science-base-automation',
       author_email='esturdivant@usgs.gov',
       url='https://github.com/esturdivant-usgs/science-base-automation',
       packages=[],
-      python_requires='~=3.3',
+      python_requires='>=3.7',
       install_requires=['lxml', 'sciencebasepy'],
      )
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+conftest.py
+
+OVERVIEW: Shared setup for the offline checks in this directory, which run autoSB
+against the in-memory stand-in for ScienceBase (fakeSB.py). Nothing is sent to SB.
+RUN: python -m pytest testing
+"""
+#%% Import packages
+import os
+import sys
+import pytest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__)))) # autoSB.py is in the parent directory
+from fakeSB import FakeSbSession
+
+def build_fake_tree(depth=2, fanout=3, **kwargs):
+    # FakeSbSession with a landing page and depth levels of fanout pages below it ('landing-0', 'landing-0-1', ...).
+    sb = FakeSbSession(**kwargs)
+    sb.add_item({'id': 'landing', 'title': 'Landing page', 'citation': 'Author, 2019', 'body': 'Abstract',
+                 'contacts': [{'name': 'Author'}], 'webLinks': [{'uri': 'https://doi.org/10.5066/P9XXXXXX'}]})
+    level = ['landing']
+    for d in range(depth):
+        next_level = []
+        for parentid in level:
+            for i in range(fanout):
+                pageid = '{}-{}'.format(parentid, i)
+                sb.add_item({'id': pageid, 'title': pageid, 'parentId': parentid})
+                next_level.append(pageid)
+        level = next_level
+    return sb
+
+@pytest.fixture
+def fake_tree():
+    return build_fake_tree
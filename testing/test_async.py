@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+test_async.py
+
+OVERVIEW: Checks of the concurrent client (AsyncSbClient, prefetch_items).
+"""
+#%% Import packages
+import time
+import asyncio
+import requests
+from autoSB import *
+from autoSB import _shared_executor
+
+def test_prefetch_items_skips_missing_pages(fake_tree):
+    sb = fake_tree(depth=1)
+    items = prefetch_items(sb, ['landing-0', 'landing-1', 'missing', None, 'landing-0'], max_connections=4)
+    assert sorted(items) == ['landing-0', 'landing-1']
+    assert sb.calls['get_item'] == 3
+
+def test_prefetch_items_inside_running_event_loop(fake_tree):
+    sb = fake_tree(depth=1)
+    async def in_notebook_cell():
+        return prefetch_items(sb, ['landing-0', 'landing-1', 'missing'], max_connections=4)
+    items = asyncio.run(in_notebook_cell())
+    assert sorted(items) == ['landing-0', 'landing-1']
+
+def test_map_returns_exceptions_in_order(fake_tree):
+    sb = fake_tree(depth=1)
+    with AsyncSbClient(sb, 4) as client:
+        results = client.map('get_item', ['landing-0', 'missing', 'landing-2'])
+    assert results[0]['id'] == 'landing-0' and results[2]['id'] == 'landing-2'
+    assert isinstance(results[1], Exception)
+
+def test_gather_runs_coroutines_concurrently(fake_tree):
+    sb = fake_tree(depth=1, latency=0.1)
+    async def fetch():
+        with AsyncSbClient(sb, 4) as client:
+            return await client.gather('get_item', [('landing-0',), ('landing-1',), ('landing-2',)])
+    start = time.time()
+    items = asyncio.run(fetch())
+    assert [item['id'] for item in items] == ['landing-0', 'landing-1', 'landing-2']
+    assert time.time() - start < 0.25
+
+def test_prefetch_items_reuses_its_threads(fake_tree):
+    sb = fake_tree(depth=1)
+    prefetch_items(sb, ['landing-0'], max_connections=4)
+    executor = _shared_executor(4)
+    prefetch_items(sb, ['landing-1'], max_connections=4)
+    assert _shared_executor(4) is executor
+    assert executor.submit(len, 'abc').result() == 3 # still running
+
+def test_connection_pool_is_mounted_once_per_session(fake_tree):
+    sb = fake_tree(depth=1)
+    sb._session = requests.Session()
+    assert pool_session_connections(sb, 32)
+    adapter = sb._session.get_adapter('https://')
+    assert pool_session_connections(sb, 32) and pool_session_connections(sb, 8)
+    assert sb._session.get_adapter('https://') is adapter
+    pool_session_connections(sb, 64)
+    assert sb._session.get_adapter('https://')._pool_maxsize == 64
+
+def test_async_uploads_pass_scrape_file(fake_tree, tmp_path):
+    sb = fake_tree(depth=1)
+    scraped = []
+    upload = sb.upload_files_and_upsert_item
+    def record(item, filenames, scrape_file=True):
+        scraped.append(scrape_file)
+        return upload(item, filenames, scrape_file)
+    sb.upload_files_and_upsert_item = record
+    fname = str(tmp_path / 'notes.txt')
+    with open(fname, 'w') as f:
+        f.write('notes')
+    async def upload_all():
+        with AsyncSbClient(sb, 2) as client:
+            await client.upload_file_to_item(sb.get_item('landing-0'), fname, scrape_file=False)
+            await client.upload_files_and_upsert_item(sb.get_item('landing-1'), [fname], False)
+            await client.upload_files_and_upsert_item(sb.get_item('landing-2'), [fname])
+    asyncio.run(upload_all())
+    assert scraped == [False, False, True]
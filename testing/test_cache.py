@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+test_cache.py
+
+OVERVIEW: Checks that CachedSbSession answers repeat reads from memory and never serves a stale page.
+"""
+#%% Import packages
+import pytest
+from autoSB import *
+
+def test_repeat_reads_come_from_the_cache(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = CachedSbSession(fake)
+    item = sb.get_item('landing-0')
+    item['title'] = 'Changed locally' # callers get copies
+    assert sb.get_item('landing-0')['title'] == 'landing-0'
+    assert fake.calls['get_item'] == 1
+    assert sb.cache_stats()['hits'] == 1
+
+def test_least_recently_used_items_are_evicted(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = CachedSbSession(fake, maxsize=2)
+    for pageid in ('landing-0', 'landing-1', 'landing-0', 'landing-2', 'landing-0'):
+        sb.get_item(pageid)
+    assert fake.calls['get_item'] == 3
+    sb.get_item('landing-1')
+    assert fake.calls['get_item'] == 4
+
+def test_writes_replace_or_invalidate_the_cached_copy(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = CachedSbSession(fake)
+    sb.get_item('landing-0')
+    sb.update_item({'id': 'landing-0', 'purpose': 'Purpose'}) # partial update is applied to the cached copy
+    item = sb.get_item('landing-0')
+    assert item['purpose'] == 'Purpose' and item['title'] == 'landing-0'
+    sb.update_item({'id': 'landing-0', 'purpose': None})
+    assert not 'purpose' in sb.get_item('landing-0')
+    assert fake.calls['get_item'] == 1
+    sb.get_item('landing-1')
+    sb.update_items([{'id': 'landing-1', 'body': 'Abstract'}])
+    assert sb.get_item('landing-1')['body'] == 'Abstract'
+    assert fake.calls['get_item'] == 3
+
+def test_deleted_pages_are_not_served(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = CachedSbSession(fake)
+    sb.get_item('landing-2')
+    sb.delete_items(['landing-2'])
+    with pytest.raises(Exception):
+        sb.get_item('landing-2')
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+test_delete.py
+
+OVERVIEW: Checks that a page subtree is deleted children first, in batches.
+"""
+#%% Import packages
+from autoSB import *
+
+def test_delete_all_children_deletes_children_before_parents(fake_tree):
+    sb = fake_tree(depth=3, fanout=2)
+    depth = {pageid: pageid.count('-') for pageid in sb.get_ancestor_ids('landing')}
+    batches = []
+    delete_items = sb.delete_items
+    def record(itemIds):
+        batches.append(list(itemIds))
+        return delete_items(itemIds)
+    sb.delete_items = record
+    message = delete_all_children(sb, 'landing', batch_size=5)
+    deleted = [pageid for batch in batches for pageid in batch]
+    assert sorted(deleted) == sorted(depth)
+    assert [depth[pageid] for pageid in deleted] == sorted((depth[pageid] for pageid in deleted), reverse=True)
+    assert [len(batch) for batch in batches] == [5, 5, 4]
+    assert sb.get_ancestor_ids('landing') == []
+    assert sb.get_item('landing')['title'] == 'Landing page'
+    assert message.startswith('DELETED')
+
+def test_delete_all_children_waits_for_searches(fake_tree):
+    sb = fake_tree(depth=1, fanout=3, index_delay=0.3)
+    message = delete_all_children(sb, 'landing', timeout=5)
+    assert message.startswith('DELETED')
+    assert sb.get_ancestor_ids('landing') == []
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+test_extents.py
+
+OVERVIEW: Checks of the page extents computed from the page tree, the local XMLs and the shapefile headers.
+"""
+#%% Import packages
+import os
+import glob
+from autoSB import *
+
+def bbox(minx, miny, maxx, maxy):
+    return {'minX': minx, 'minY': miny, 'maxX': maxx, 'maxY': maxy}
+
+def tree_with_extents(fake_tree):
+    # Two levels of pages below the landing page; each bottom page has its own bounding box.
+    sb = fake_tree(depth=2, fanout=2)
+    for i, pageid in enumerate(['landing-0-0', 'landing-0-1', 'landing-1-0', 'landing-1-1']):
+        sb.update_item({'id': pageid, 'spatial': {'boundingBox': bbox(-80 + i, 30 + i, -79 + i, 31 + i)}})
+    return sb
+
+def page_bbox(sb, pageid):
+    return sb.get_item(pageid)['spatial']['boundingBox']
+
+def test_union_bboxes():
+    assert union_bboxes([bbox(0, 1, 2, 3), None, bbox(-1, 2, 1, 4)]) == bbox(-1, 1, 2, 4)
+    assert union_bboxes([None]) is None
+
+def test_facet_bbox_comes_before_spatial():
+    item = {'facets': [{'boundingBox': bbox(0, 0, 1, 1)}], 'spatial': {'boundingBox': bbox(5, 5, 6, 6)}}
+    assert get_item_bbox(item) == bbox(0, 0, 1, 1)
+    assert get_item_bbox({'spatial': {'boundingBox': bbox(5, 5, 6, 6)}}) == bbox(5, 5, 6, 6)
+    assert get_item_bbox({}) is None
+
+def test_set_parent_extent_sets_every_parent_in_one_pass(fake_tree):
+    sb = tree_with_extents(fake_tree)
+    changes = set_parent_extent(sb, 'landing')
+    assert sorted(changes) == ['landing', 'landing-0', 'landing-1']
+    assert page_bbox(sb, 'landing-0') == bbox(-80, 30, -78, 32)
+    assert page_bbox(sb, 'landing-1') == bbox(-78, 32, -76, 34)
+    assert page_bbox(sb, 'landing') == bbox(-80, 30, -76, 34)
+    assert sb.calls['update_items'] == 1
+    assert sb.calls['get_child_ids'] == 0
+    # Nothing has changed the second time
+    assert set_parent_extent(sb, 'landing') == {}
+    assert sb.calls['update_items'] == 1
+
+def test_update_extents_above_recomputes_only_the_changed_branch(fake_tree, tmp_path):
+    sb = tree_with_extents(fake_tree)
+    extent_cache = {}
+    set_parent_extent(sb, 'landing', extent_cache=extent_cache)
+    fname = save_extent_cache(str(tmp_path / 'extents.json'), extent_cache)
+    extent_cache = load_extent_cache(fname)
+    assert sorted(extent_cache) == sorted(['landing'] + sb.get_ancestor_ids('landing'))
+    # One data page grows; only the pages above it are recomputed and written
+    sb.update_item({'id': 'landing-1-1', 'spatial': {'boundingBox': bbox(-77, 33, -70, 40)}})
+    before = dict(sb.calls)
+    changes = set_parent_extent(sb, 'landing', changed_ids=['landing-1-1'], extent_cache=extent_cache)
+    assert sorted(changes) == ['landing', 'landing-1']
+    assert page_bbox(sb, 'landing-1') == bbox(-78, 32, -70, 40)
+    assert page_bbox(sb, 'landing') == bbox(-80, 30, -70, 40)
+    assert sb.calls['find_items'] - before.get('find_items', 0) == 2 # the children of landing-1 and of landing
+    # A data page whose bbox did not change stops the walk at once
+    assert set_parent_extent(sb, 'landing', changed_ids=['landing-0-0'], extent_cache=extent_cache) == {}
+
+def test_missing_extent_cache_file_gives_empty_cache(tmp_path):
+    assert load_extent_cache(str(tmp_path / 'none.json')) == {}
+
+def release_pages(parentdir):
+    # A FakeSbSession page for parentdir and every directory below it, and the dict_DIRtoID for them.
+    from fakeSB import FakeSbSession
+    sb = FakeSbSession()
+    top = os.path.dirname(parentdir)
+    dict_DIRtoID = {}
+    for dirpath in sorted([parentdir] + [d for d in glob.glob(os.path.join(parentdir, '**/'), recursive=True) if d.rstrip(os.sep) != parentdir]):
+        relpath = os.path.relpath(dirpath.rstrip(os.sep), top)
+        parentid = dict_DIRtoID.get(os.path.dirname(relpath))
+        dict_DIRtoID[relpath] = sb.add_item({'title': os.path.basename(relpath), 'parentId': parentid} if parentid else {'title': relpath})['id']
+    return sb, dict_DIRtoID
+
+def test_extents_from_xmls(tmp_path):
+    from benchmark_autoSB import make_release
+    parentdir = str(tmp_path / 'release')
+    make_release(parentdir, 2, 2, 1, 1, 1, 0)
+    sb, dict_DIRtoID = release_pages(parentdir)
+    xmllist = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
+    extents = extents_from_xmls(parentdir, dict_DIRtoID)
+    assert extents[dict_DIRtoID['release']] == union_bboxes([get_bbox_from_xml(x) for x in xmllist])
+    folder = os.path.join('release', 'folder 1')
+    assert extents[dict_DIRtoID[folder]] == union_bboxes([get_bbox_from_xml(x) for x in xmllist if os.sep + 'folder 1' + os.sep in x])
+    # Written in one request; with a snapshot, pages that already match are not written again
+    changes = set_extent_from_xmls(sb, parentdir, dict_DIRtoID)
+    assert sorted(changes) == sorted(extents)
+    assert sb.calls['update_items'] == 1
+    snapshot = ReleaseSnapshot.load(sb, dict_DIRtoID['release'], fields=extent_fields)
+    assert set_extent_from_xmls(sb, parentdir, dict_DIRtoID, snapshot=snapshot) == {}
+
+def test_read_shp_bbox(tmp_path):
+    from benchmark_autoSB import write_shp
+    shp_file = str(tmp_path / 'data.shp')
+    write_shp(shp_file, (-75.5, 35.25, -75.0, 36.0), 1000)
+    assert read_shp_bbox(shp_file) == bbox(-75.5, 35.25, -75.0, 36.0)
+    with open(str(tmp_path / 'other.shp'), 'wb') as f:
+        f.write(b'\0' * 200)
+    assert read_shp_bbox(str(tmp_path / 'other.shp')) is None
+    assert read_shp_bbox(str(tmp_path / 'missing.shp')) is None
+
+def test_check_xml_extents_flags_only_stale_xmls(tmp_path):
+    from benchmark_autoSB import make_release
+    parentdir = str(tmp_path / 'release')
+    make_release(parentdir, 1, 3, 1, 1, 1, 0)
+    shp_bboxes = shp_extents(parentdir)
+    assert len(shp_bboxes) == 3
+    assert check_xml_extents(parentdir, shp_bboxes, verbose=False) == []
+    xml_file = sorted(glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True))[0]
+    replace_in_file(xml_file, '<westbc>-', '<westbc>-1') # e.g. -75.3 becomes -175.3
+    stale = check_xml_extents(parentdir, shp_bboxes, verbose=False)
+    assert [s[0] for s in stale] == [xml_file]
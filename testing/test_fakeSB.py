@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+test_fakeSB.py
+
+OVERVIEW: Checks that FakeSbSession behaves like the parts of ScienceBase that autoSB relies on.
+"""
+#%% Import packages
+import time
+import pytest
+from fakeSB import FakeSbSession, FakeSbError
+
+def test_searches_are_paged_with_nextlink(fake_tree):
+    sb = fake_tree(depth=1, fanout=12)
+    items = sb.find_items({'filter': 'parentIdExcludingLinks=landing', 'max': 5})
+    ids = []
+    pages = 0
+    while items:
+        pages += 1
+        ids += [item['id'] for item in items['items']]
+        items = sb.next(items)
+    assert pages == 3
+    assert sorted(ids) == sorted(sb.get_child_ids('landing'))
+    assert len(ids) == 12
+    assert sb.calls['find_items'] == 4 # three pages here and one in get_child_ids()
+
+def test_new_pages_show_up_in_searches_after_index_delay():
+    sb = FakeSbSession(index_delay=0.2)
+    sb.add_item({'id': 'landing', 'title': 'Landing page'})
+    page = sb.create_item({'parentId': 'landing', 'title': 'New page'})
+    assert sb.get_item(page['id'])['title'] == 'New page' # reads see it at once
+    assert sb.get_child_ids('landing') == []
+    time.sleep(0.25)
+    assert sb.get_child_ids('landing') == [page['id']]
+
+def test_update_merges_fields_and_none_removes_them(fake_tree):
+    sb = fake_tree(depth=1)
+    sb.update_item({'id': 'landing-0', 'purpose': 'Purpose', 'body': 'Abstract'})
+    sb.update_item({'id': 'landing-0', 'body': None})
+    item = sb.get_item('landing-0')
+    assert item['purpose'] == 'Purpose'
+    assert not 'body' in item
+    assert item['title'] == 'landing-0'
+
+def test_pages_with_children_cannot_be_deleted(fake_tree):
+    sb = fake_tree(depth=2, fanout=1)
+    with pytest.raises(FakeSbError):
+        sb.delete_items(['landing-0'])
+    sb.delete_items(['landing-0-0', 'landing-0'])
+    assert sb.get_ancestor_ids('landing') == []
+
+def test_error_rate_by_method(fake_tree):
+    sb = fake_tree(depth=1, error_rate={'update_item': 1.0})
+    assert sb.get_item('landing-0')['id'] == 'landing-0'
+    with pytest.raises(FakeSbError):
+        sb.update_item({'id': 'landing-0', 'purpose': 'Purpose'})
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+test_inherit.py
+
+OVERVIEW: Checks that fields are passed down the page tree with only the writes that are needed.
+"""
+#%% Import packages
+import pytest
+from autoSB import *
+
+inherits = ['citation', 'contacts', 'body', 'webLinks', 'relatedItems']
+
+def writes(sb):
+    return sb.calls['update_item'] + sb.calls['update_items']
+
+def test_plan_inheritance_lists_only_differences():
+    parent = {'title': 'Parent', 'citation': 'Author, 2019', 'body': 'Abstract'}
+    child = {'title': 'Child', 'citation': 'Author, 2019', 'body': 'Old abstract', 'purpose': 'Purpose'}
+    assert plan_inheritance(child, parent, ['citation', 'body', 'purpose']) == {'body': 'Abstract', 'purpose': None}
+    assert plan_inheritance(child, parent, ['citation', 'purpose'], inherit_void=False) == {}
+
+def test_inherit_topdown_rerun_makes_no_writes(fake_tree):
+    sb = fake_tree()
+    inherit_topdown(sb, 'landing', inherits, inherits)
+    assert writes(sb) == 12
+    assert sb.get_item('landing-0-0')['citation'] == 'Author, 2019'
+    assert sb.get_item('landing-0-0')['contacts'] == [{'name': 'Author'}]
+    inherit_topdown(sb, 'landing', inherits, inherits)
+    assert writes(sb) == 12
+
+def test_inherit_topdown_with_snapshot_rerun_makes_no_writes(fake_tree):
+    sb = fake_tree()
+    inherit_topdown(sb, 'landing', inherits, inherits, snapshot=ReleaseSnapshot.load(sb, 'landing'))
+    assert writes(sb) == 12
+    inherit_topdown(sb, 'landing', inherits, inherits, snapshot=ReleaseSnapshot.load(sb, 'landing'))
+    assert writes(sb) == 12
+
+def test_only_changed_fields_are_sent(fake_tree):
+    sb = fake_tree(depth=1, fanout=1)
+    inherit_topdown(sb, 'landing', inherits, inherits)
+    sent = []
+    update_item = sb.update_item
+    sb.update_item = lambda item_json: sent.append(dict(item_json)) or update_item(item_json)
+    sb.update_item({'id': 'landing', 'body': 'New abstract'})
+    del sent[:]
+    inherit_topdown(sb, 'landing', inherits, inherits)
+    assert sent == [{'id': 'landing-0', 'body': 'New abstract'}]
+
+def test_inherit_topdown_with_snapshot_accepts_previewImage(fake_tree):
+    sb = fake_tree()
+    snapshot = ReleaseSnapshot.load(sb, 'landing')
+    inherit_topdown(sb, 'landing', inherits + ['previewImage'], inherits + ['previewImage'], snapshot=snapshot)
+    assert writes(sb) == 12
+    assert not 'previewImage' in sb.get_item('landing-0-0')
+    with pytest.raises(ValueError):
+        inherit_topdown(sb, 'landing', ['purpose'], ['purpose'], snapshot=ReleaseSnapshot.load(sb, 'landing', fields=['title', 'parentId']))
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+test_instrument.py
+
+OVERVIEW: Checks of the ScienceBase call counts kept by InstrumentedSbSession.
+"""
+#%% Import packages
+import json
+from autoSB import *
+
+def calls_by(sb, function):
+    return {r['method']: r['calls'] for r in sb.report() if r['function'] == function}
+
+def test_calls_are_counted_by_autoSB_function(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = InstrumentedSbSession(fake)
+    ReleaseSnapshot.load(sb, 'landing')
+    assert calls_by(sb, 'ReleaseSnapshot.load')['get_item'] == 1
+    assert calls_by(sb, 'ReleaseSnapshot.load')['find_items'] == 1
+    sb.get_item('landing-0')
+    assert calls_by(sb, 'test_calls_are_counted_by_autoSB_function (test_instrument.py)') == {'get_item': 1}
+
+def test_calls_through_wrappers_are_counted_once(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = CachedSbSession(InstrumentedSbSession(fake))
+    sb.get_item('landing-0')
+    sb.get_item('landing-0')
+    assert sum(r['calls'] for r in sb._sb.report()) == 1
+    assert fake.calls['get_item'] == 1
+
+def test_bytes_received_are_estimated_from_the_items(fake_tree):
+    sb = InstrumentedSbSession(fake_tree(depth=1))
+    item = sb.get_item('landing')
+    row = sb.report()[0]
+    assert row['bytes_received'] == len(json.dumps(item))
+    assert row['errors'] == 0
+
+def test_calls_on_pool_threads_are_credited_to_the_submitting_function(fake_tree):
+    sb = InstrumentedSbSession(fake_tree(depth=2))
+    def fetch_pages(sb, pageids):
+        return prefetch_items(sb, pageids, max_connections=4)
+    assert len(fetch_pages(sb, ['landing-0', 'landing-1', 'landing-2'])) == 3
+    inherit_topdown(sb, 'landing', ['citation'], ['citation'], max_workers=4)
+    functions = set(r['function'] for r in sb.report())
+    assert calls_by(sb, 'fetch_pages (test_instrument.py)') == {'get_item': 3}
+    assert 'inherit_topdown' in functions
+    assert not any('thread' in f for f in functions)
+
+def test_next_counts_only_pages_that_are_fetched(fake_tree):
+    sb = InstrumentedSbSession(fake_tree(depth=1, fanout=12))
+    ReleaseSnapshot.load(sb, 'landing')
+    assert not 'next' in calls_by(sb, 'ReleaseSnapshot.load')
+    ReleaseSnapshot.load(sb, 'landing', max_per_page=5)
+    calls = [r for r in sb.report() if r['method'] == 'next']
+    assert [r['calls'] for r in calls] == [2]
+    assert calls[0]['bytes_sent'] == 0
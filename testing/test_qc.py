@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+test_qc.py
+
+OVERVIEW: Checks of the page field QA report made from a ReleaseSnapshot.
+"""
+#%% Import packages
+import csv
+import json
+import pytest
+from autoSB import *
+
+def test_qc_report_lists_only_failed_checks(fake_tree):
+    sb = fake_tree(depth=1, fanout=3)
+    sb.update_item({'id': 'landing-0', 'contacts': [{'name': 'A'}, {'name': 'B'}]})
+    sb.update_item({'id': 'landing-1', 'contacts': [{'name': 'A'}], 'webLinks': [{'uri': 'https://doi.org'}]})
+    snapshot = ReleaseSnapshot.load(sb, 'landing')
+    calls = sb.call_count()
+    rows = qc_report(snapshot, {'contacts': 2, 'webLinks': 0})
+    assert sb.call_count() == calls # nothing is requested from SB
+    failed = sorted((row['id'], row['field'], row['actual']) for row in rows)
+    assert failed == [('landing-1', 'contacts', 1), ('landing-1', 'webLinks', 1), ('landing-2', 'contacts', 0)]
+
+def test_qc_report_refuses_fields_that_were_not_loaded(fake_tree):
+    snapshot = ReleaseSnapshot.load(fake_tree(depth=1), 'landing', fields=['title', 'parentId'])
+    with pytest.raises(ValueError):
+        qc_report(snapshot, {'contacts': 1})
+
+def test_save_qc_report(fake_tree, tmp_path):
+    snapshot = ReleaseSnapshot.load(fake_tree(depth=1, fanout=2), 'landing')
+    rows = qc_report(snapshot, {'contacts': 1})
+    with open(save_qc_report(rows, str(tmp_path / 'qc_report.csv')), newline='') as f:
+        saved = list(csv.DictReader(f))
+    assert [row['id'] for row in saved] == [row['id'] for row in rows]
+    assert list(saved[0]) == qc_columns
+    with open(save_qc_report(rows, str(tmp_path / 'qc_report.json'))) as f:
+        assert json.load(f) == rows
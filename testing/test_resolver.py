@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+test_resolver.py
+
+OVERVIEW: Checks that PageIdResolver finds the page of every XML from one search of the release.
+"""
+#%% Import packages
+import os
+import glob
+import shutil
+from autoSB import *
+from fakeSB import FakeSbSession
+from benchmark_autoSB import make_release
+
+def release_with_pages(tmp_path):
+    parentdir = str(tmp_path / 'release')
+    make_release(parentdir, 2, 2, 1, 1, 1, 0)
+    sb = FakeSbSession()
+    sb.add_item({'id': 'landing', 'title': 'release'})
+    dict_DIRtoID = setup_subparents(sb, parentdir, 'landing', False, verbose=False)
+    return parentdir, sb, dict_DIRtoID
+
+def test_resolver_finds_pages_by_the_page_tree(tmp_path):
+    parentdir, sb, dict_DIRtoID = release_with_pages(tmp_path)
+    resolver = PageIdResolver(sb, parentdir, 'landing') # without dict_DIRtoID
+    before = sb.calls['find_items']
+    for xml_file in glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True):
+        assert resolver.resolve(xml_file) == dict_DIRtoID[resolver.relpath(xml_file)]
+    assert sb.calls['find_items'] - before == 1
+    assert resolver.valid_ids == set(dict_DIRtoID.values())
+
+def test_resolver_uses_dict_DIRtoID_without_searching(tmp_path):
+    parentdir, sb, dict_DIRtoID = release_with_pages(tmp_path)
+    resolver = PageIdResolver(sb, parentdir, 'landing', dict_DIRtoID)
+    calls = sb.call_count()
+    xml_file = glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)[0]
+    assert resolver.resolve(xml_file) == dict_DIRtoID[resolver.relpath(xml_file)]
+    assert sb.call_count() == calls
+
+def test_resolver_falls_back_to_the_xml_onlink_and_remembers_misses(tmp_path, capsys):
+    parentdir, sb, dict_DIRtoID = release_with_pages(tmp_path)
+    resolver = PageIdResolver(sb, parentdir, 'landing', dict_DIRtoID).load()
+    xml_file = glob.glob(os.path.join(parentdir, 'folder 1', 'folder 1-1', '*.xml'))[0]
+    page_id = dict_DIRtoID[os.path.join('release', 'folder 1', 'folder 1-1')]
+    # A renamed folder: found from the page URL in the XML citation
+    os.makedirs(os.path.join(parentdir, 'renamed'))
+    renamed = shutil.copy(xml_file, os.path.join(parentdir, 'renamed'))
+    replace_in_file(renamed, 'catalog/item/XXXXX', 'catalog/item/' + page_id)
+    assert resolver.resolve(renamed) == page_id
+    # A folder with no page: None, and the XML is not looked up again
+    os.makedirs(os.path.join(parentdir, 'stray'))
+    stray = shutil.copy(xml_file, os.path.join(parentdir, 'stray'))
+    assert resolver.resolve(stray) is None
+    calls = sb.call_count()
+    assert resolver.resolve(stray) is None
+    assert sb.call_count() == calls
+    assert 'Could not find page matching XML file' in capsys.readouterr().out
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+test_session.py
+
+OVERVIEW: Checks that SbSessionManager keeps one session and logs in again only when it has to.
+"""
+#%% Import packages
+from autoSB import *
+from fakeSB import FakeSbSession
+
+class StubSessionEx(object):
+    # Stands in for the token handling of a sciencebasepy >= 2 session.
+    def __init__(self, remaining):
+        self.remaining = remaining
+
+    def refresh_token_time_remaining(self):
+        return self.remaining
+
+class StubSession(object):
+    # SbSession with a token that expires in remaining seconds; counts refreshes and logins.
+    def __init__(self, remaining=3600, refresh_fails=False):
+        self._sbSessionEx = StubSessionEx(remaining)
+        self.refresh_fails = refresh_fails
+        self.refreshes = 0
+        self.logins = 0
+
+    def refresh_token(self):
+        self.refreshes += 1
+        if self.refresh_fails:
+            raise Exception('Refresh token expired')
+        self._sbSessionEx.remaining = 3600
+
+    def login(self, username, password):
+        self.logins += 1
+        self._sbSessionEx.remaining = 3600
+        return self
+
+def managed(sb, **kwargs):
+    manager = SbSessionManager(**kwargs)
+    manager.adopt(sb)
+    return manager
+
+def test_live_session_is_reused_without_requests():
+    sb = StubSession()
+    manager = managed(sb)
+    assert manager.get('user@usgs.gov', 'password') is sb
+    assert manager.get() is sb
+    assert (sb.refreshes, sb.logins) == (0, 0)
+
+def test_token_close_to_expiring_is_refreshed_not_logged_in():
+    sb = StubSession(remaining=100)
+    manager = managed(sb)
+    assert manager.get('user@usgs.gov', 'password') is sb
+    assert (sb.refreshes, sb.logins) == (1, 0)
+    manager.get()
+    assert sb.refreshes == 1 # the refreshed token is good for another hour
+
+def test_expired_token_is_refreshed_before_logging_in_again():
+    sb = StubSession(remaining=0)
+    manager = managed(sb)
+    assert manager.get('user@usgs.gov', 'password') is sb
+    assert (sb.refreshes, sb.logins) == (1, 0)
+
+def test_failed_refresh_logs_the_same_session_back_in():
+    sb = StubSession(remaining=0, refresh_fails=True)
+    manager = managed(sb)
+    assert manager.get('user@usgs.gov', 'password') is sb
+    assert (sb.refreshes, sb.logins) == (1, 1)
+
+def test_older_sessions_are_checked_once_per_interval():
+    sb = FakeSbSession()
+    manager = managed(sb, check_interval=300)
+    manager.get('user@usgs.gov', 'password')
+    manager.get()
+    assert sb.calls['is_logged_in'] == 0
+    manager.check_interval = 0
+    manager.get()
+    assert sb.calls['is_logged_in'] == 1
+
+def test_wrapped_session_is_handed_out():
+    manager = managed(FakeSbSession())
+    wrapped = manager.wrap(CachedSbSession)
+    assert manager.get() is wrapped
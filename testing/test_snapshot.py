@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+test_snapshot.py
+
+OVERVIEW: Checks of ReleaseSnapshot, the in-memory copy of a release page tree.
+"""
+#%% Import packages
+from autoSB import *
+
+def test_load_indexes_the_whole_tree(fake_tree):
+    sb = fake_tree(depth=2, fanout=3)
+    snapshot = ReleaseSnapshot.load(sb, 'landing')
+    assert len(snapshot) == 13
+    assert [len(level) for level in snapshot.levels()] == [1, 3, 9]
+    assert sorted(snapshot.get_child_ids('landing-1')) == ['landing-1-0', 'landing-1-1', 'landing-1-2']
+    assert snapshot.ancestors('landing-1-2') == ['landing-1', 'landing']
+    assert snapshot.items['landing-1']['hasChildren'] and not snapshot.items['landing-1-2']['hasChildren']
+
+def test_load_counts_only_the_search_pages_it_fetches(fake_tree, capsys):
+    sb = fake_tree(depth=2, fanout=3)
+    ReleaseSnapshot.load(sb, 'landing', max_per_page=5, verbose=True)
+    assert sb.calls['find_items'] == 3 # pages of 5, 5 and 2
+    assert 'in 3 requests' in capsys.readouterr().out
+
+def test_remove_drops_descendants(fake_tree):
+    snapshot = ReleaseSnapshot.load(fake_tree(depth=2, fanout=2), 'landing')
+    snapshot.remove('landing-0')
+    assert snapshot.descendants() == ['landing-1', 'landing-1-0', 'landing-1-1']
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+test_subparents.py
+
+OVERVIEW: Checks of how the folder pages of a data release are found or created.
+"""
+#%% Import packages
+import os
+import time
+from autoSB import *
+from fakeSB import FakeSbSession
+
+def test_title_index_lists_each_parent_once(fake_tree):
+    sb = fake_tree(depth=1, fanout=5)
+    title_index = ChildTitleIndex(sb, max_per_page=2)
+    assert title_index.get('landing', 'landing-3') == 'landing-3'
+    assert title_index.get('landing', 'landing-4') == 'landing-4'
+    assert title_index.get('landing', 'no such page') is None
+    assert len(title_index.titles('landing')) == 5
+    assert sb.calls['find_items'] == 3 # one listing, in pages of 2
+
+def test_find_or_create_child_creates_a_page_once(fake_tree):
+    sb = fake_tree(depth=1)
+    title_index = ChildTitleIndex(sb)
+    page = find_or_create_child(sb, 'landing', 'New page', title_index=title_index)
+    again = find_or_create_child(sb, 'landing', 'New page', title_index=title_index)
+    found = find_or_create_child(sb, 'landing', 'landing-1', title_index=title_index)
+    assert again['id'] == page['id']
+    assert found['id'] == 'landing-1'
+    assert sb.calls['create_item'] == 1
+    assert sb.calls['find_items'] == 1
+
+def test_wait_for_pages_returns_once_new_pages_are_searchable():
+    sb = FakeSbSession(index_delay=0.3)
+    sb.add_item({'id': 'landing', 'title': 'Landing page'})
+    page = sb.create_item({'parentId': 'landing', 'title': 'New page'})
+    start = time.time()
+    assert wait_for_pages(sb, 'landing', [page['id']], first_wait=0.1, verbose=False) == []
+    assert time.time() - start >= 0.25
+    assert sb.calls['find_items'] <= 4 # 0, 0.1, 0.3 and 0.7 seconds at most
+
+def test_wait_for_pages_reports_stragglers(capsys):
+    sb = FakeSbSession(index_delay=10)
+    sb.add_item({'id': 'landing', 'title': 'Landing page'})
+    page = sb.create_item({'parentId': 'landing', 'title': 'New page'})
+    assert wait_for_pages(sb, 'landing', [page['id']], timeout=0.3, first_wait=0.1) == [page['id']]
+    assert 'STRAGGLER: page {}'.format(page['id']) in capsys.readouterr().out
+    assert wait_for_pages(sb, 'landing', [], verbose=False) == []
+
+def test_title_index_remembers_the_pages_it_created(fake_tree):
+    sb = fake_tree(depth=1)
+    title_index = ChildTitleIndex(sb)
+    page = find_or_create_child(sb, 'landing', 'New page', title_index=title_index)
+    find_or_create_child(sb, 'landing', 'landing-1', title_index=title_index)
+    assert title_index.created == [page['id']]
+
+def test_setup_subparents_creates_each_level_in_one_request(tmp_path):
+    from benchmark_autoSB import make_release
+    parentdir = str(tmp_path / 'release')
+    make_release(parentdir, 2, 3, 1, 1, 1, 0)
+    sb = FakeSbSession()
+    sb.add_item({'id': 'landing', 'title': 'release'})
+    dict_DIRtoID = setup_subparents(sb, parentdir, 'landing', False, verbose=False)
+    assert len(dict_DIRtoID) == 1 + 3 + 9
+    assert sb.calls['create_items'] == 2
+    assert sb.calls['create_item'] == 0
+    page = sb.get_item(dict_DIRtoID[os.path.join('release', 'folder 2', 'folder 2-3')])
+    assert page['title'] == 'folder 2-3'
+    assert page['parentId'] == dict_DIRtoID[os.path.join('release', 'folder 2')]
+    # A second run finds every page
+    assert setup_subparents(sb, parentdir, 'landing', False, verbose=False) == dict_DIRtoID
+    assert sb.calls['create_items'] == 2
+
+def test_setup_subparents_matches_created_pages_by_position(tmp_path):
+    from benchmark_autoSB import make_release
+    parentdir = str(tmp_path / 'release')
+    make_release(parentdir, 1, 3, 1, 1, 1, 0)
+    sb = FakeSbSession()
+    sb.add_item({'id': 'landing', 'title': 'release'})
+    create_items = sb.create_items
+    def trim_titles(items_json):
+        # SB may change the titles it is sent, so they cannot be used to match the responses
+        return create_items([dict(item, title=item['title'].replace('folder ', 'F')) for item in items_json])
+    sb.create_items = trim_titles
+    dict_DIRtoID = setup_subparents(sb, parentdir, 'landing', False, verbose=False)
+    for i in (1, 2, 3):
+        assert sb.get_item(dict_DIRtoID[os.path.join('release', 'folder {}'.format(i))])['title'] == 'F{}'.format(i)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+test_tree.py
+
+OVERVIEW: Checks that the tree walks visit every page in order on a pool of threads.
+"""
+#%% Import packages
+import threading
+from autoSB import *
+
+def test_walk_topdown_runs_parents_before_children(fake_tree):
+    sb = fake_tree(depth=3, fanout=2)
+    done = []
+    lock = threading.Lock()
+    def task(pid, parent_result):
+        with lock:
+            done.append(pid)
+        return pid
+    assert walk_topdown(sb, 'landing', task, max_workers=4) == {}
+    assert len(done) == 14
+    assert all(done.index(pid.rsplit('-', 1)[0]) < done.index(pid) for pid in done if pid.count('-') > 1)
+
+def test_walk_bottomup_runs_children_before_parents(fake_tree):
+    sb = fake_tree(depth=3, fanout=2)
+    done = []
+    lock = threading.Lock()
+    def task(pid):
+        with lock:
+            done.append(pid)
+    assert walk_bottomup(sb, 'landing', task, max_workers=4) == {}
+    assert len(done) == 14 and not 'landing' in done
+    assert all(done.index(pid.rsplit('-', 1)[0]) > done.index(pid) for pid in done if pid.count('-') > 1)
+
+def test_walk_topdown_skips_below_a_failed_page(fake_tree):
+    sb = fake_tree(depth=2, fanout=2)
+    def task(pid, parent_result):
+        if pid == 'landing-0':
+            raise ValueError('bad page')
+        return pid
+    errors = walk_topdown(sb, 'landing', task, max_workers=4)
+    assert list(errors) == ['landing-0']
+
+def test_apply_functions_return_true_and_print_failures(fake_tree, capsys):
+    sb = fake_tree(depth=2, fanout=2)
+    def set_purpose(sb, item):
+        if item['id'] == 'landing-1-1':
+            raise ValueError('bad page')
+        sb.update_item({'id': item['id'], 'purpose': 'Purpose'})
+    assert apply_topdown(sb, 'landing', set_purpose, max_workers=4) is True
+    assert apply_bottomup(sb, 'landing', set_purpose, max_workers=4) is True
+    assert inherit_topdown(sb, 'landing', ['citation'], ['citation'], max_workers=4) is True
+    assert sb.get_item('landing-0-1')['purpose'] == 'Purpose'
+    assert 'EXCEPTION on page landing-1-1: bad page' in capsys.readouterr().out
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+test_writeback.py
+
+OVERVIEW: Checks that WriteBackSbSession writes each page once, with only the changed fields.
+"""
+#%% Import packages
+import pytest
+from autoSB import *
+from fakeSB import FakeSbSession, FakeSbError
+
+def recording_session():
+    # FakeSbSession with one page that records the JSON of every update_item() call in sent.
+    fake = FakeSbSession()
+    fake.add_item({'id': 'page', 'title': 'Page', 'body': 'Abstract', 'purpose': 'Old purpose'})
+    fake.sent = []
+    update_item = fake.update_item
+    def record(item_json):
+        fake.sent.append(dict(item_json))
+        return update_item(item_json)
+    fake.update_item = record
+    return fake
+
+def test_flush_sends_only_changed_fields():
+    fake = recording_session()
+    sb = WriteBackSbSession(fake)
+    item = sb.get_item('page')
+    item['purpose'] = 'New purpose'
+    sb.update_item(item)
+    item = sb.get_item('page')
+    item['body'] = 'Abstract' # unchanged
+    sb.update_item(item)
+    assert fake.sent == [] # nothing is written before flush()
+    assert sb.get_item('page')['purpose'] == 'New purpose' # reads see the pending change
+    assert flush_writes(sb) == 1
+    assert fake.sent == [{'id': 'page', 'purpose': 'New purpose'}]
+    assert fake.get_item('page')['purpose'] == 'New purpose'
+    assert flush_writes(sb) == 0 # nothing left to write
+
+def test_change_set_back_is_not_written():
+    fake = recording_session()
+    sb = WriteBackSbSession(fake)
+    item = sb.get_item('page')
+    sb.update_item(dict(item, purpose='New purpose'))
+    sb.update_item(dict(item, purpose='Old purpose'))
+    assert sb.pending_ids() == []
+    assert flush_writes(sb) == 0
+    assert fake.sent == []
+
+def test_several_pages_are_written_in_one_request(fake_tree):
+    fake = fake_tree(depth=1, fanout=3)
+    sb = WriteBackSbSession(fake)
+    for pageid in fake.get_child_ids('landing'):
+        sb.update_item({'id': pageid, 'purpose': 'Purpose'})
+    assert flush_writes(sb) == 3
+    assert fake.calls['update_items'] == 1
+    assert fake.calls['update_item'] == 0
+    assert all(fake.get_item(pageid)['purpose'] == 'Purpose' for pageid in fake.get_child_ids('landing'))
+
+def test_upload_carries_pending_changes(tmp_path):
+    fake = recording_session()
+    sb = WriteBackSbSession(fake)
+    sb.update_item(dict(sb.get_item('page'), purpose='New purpose'))
+    fname = str(tmp_path / 'notes.txt')
+    with open(fname, 'w') as f:
+        f.write('notes')
+    item = sb.upload_file_to_item(sb.get_item('page'), fname)
+    assert item['purpose'] == 'New purpose'
+    assert fake.get_item('page')['purpose'] == 'New purpose'
+    assert flush_writes(sb) == 0
+    assert fake.sent == []
+
+def test_flush_writes_only_requested_pages(fake_tree):
+    fake = fake_tree(depth=1)
+    sb = WriteBackSbSession(fake)
+    for pageid in ('landing-0', 'landing-1'):
+        item = sb.get_item(pageid)
+        item['purpose'] = 'Purpose'
+        sb.update_item(item)
+    assert flush_writes(sb, itemids=['landing-0']) == 1
+    assert fake.get_item('landing-0')['purpose'] == 'Purpose'
+    assert not 'purpose' in fake.get_item('landing-1')
+    assert sb.pending_ids() == ['landing-1']
+
+def test_failed_upload_keeps_pending_changes(tmp_path):
+    fake = recording_session()
+    fake.error_rate = {'upload_files_and_upsert_item': 1.0}
+    sb = WriteBackSbSession(fake)
+    sb.update_item(dict(sb.get_item('page'), purpose='New purpose'))
+    fname = str(tmp_path / 'notes.txt')
+    with open(fname, 'w') as f:
+        f.write('notes')
+    with pytest.raises(FakeSbError):
+        sb.upload_file_to_item(sb.get_item('page'), fname)
+    assert sb.pending_ids() == ['page']
+    assert flush_writes(sb) == 1
+    assert fake.sent == [{'id': 'page', 'purpose': 'New purpose'}]
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+test_xml.py
+
+OVERVIEW: Checks of the changes update_xml() and update_all_xmls() make to the FGDC XMLs.
+"""
+#%% Import packages
+import os
+import glob
+import pickle
+from datetime import datetime
+from lxml import etree
+from autoSB import *
+from benchmark_autoSB import make_release
+
+new_values = {'landing_id': 'landing', 'doi': '10.5066/P9XXXXXX', 'pubdate': '2019',
+              'find_and_replace': {'dx.doi.org': 'doi.org'}}
+
+def release_xmls(tmp_path, name='release'):
+    parentdir = str(tmp_path / name)
+    make_release(parentdir, 1, 3, 1, 1, 1, 0)
+    return parentdir, sorted(glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True))
+
+def test_update_xml_sets_values_and_replaces_text(tmp_path):
+    parentdir, xmllist = release_xmls(tmp_path)
+    xml_file = xmllist[0]
+    with open(xml_file, 'rb') as f:
+        original = f.read()
+    update_xml(xml_file, dict(new_values, child_id='page1'))
+    with open(xml_file + '_orig', 'rb') as f:
+        assert f.read() == original
+    with open(xml_file, encoding='utf-8') as f:
+        text = f.read()
+    assert not 'dx.doi.org' in text
+    root = etree.fromstring(text.encode('utf-8'))
+    assert root.findtext('./idinfo/citation/citeinfo/serinfo/issue') == 'DOI:10.5066/P9XXXXXX'
+    assert [e.text for e in root.findall('./idinfo/citation/citeinfo/onlink')] == [
+        'https://doi.org/10.5066/P9XXXXXX', 'https://www.sciencebase.gov/catalog/item/page1']
+    assert root.findtext('./idinfo/citation/citeinfo/lworkcit/citeinfo/onlink') == 'https://doi.org/10.5066/P9XXXXXX'
+    assert root.findtext('./idinfo/citation/citeinfo/pubdate') == '2019'
+    assert root.findtext('./metainfo/metd') == datetime.now().strftime('%Y%m%d')
+
+def test_transform_plan_matches_map_newvals2xml():
+    plan = TransformPlan(new_values)
+    page_values = dict(new_values, child_id='page1', browse_file='page1_browse.png')
+    assert plan.tag_values('page1', 'page1_browse.png') == flip_dict(map_newvals2xml(page_values))
+
+def test_pickled_transform_plan_makes_the_same_xml(tmp_path):
+    values = dict(new_values, metadata_replacements={'./idinfo': '<descript><abstract>New</abstract><purpose>New</purpose></descript>'})
+    plan = TransformPlan(values)
+    copied = pickle.loads(pickle.dumps(plan))
+    contents = []
+    for name, p in [('a', plan), ('b', copied)]:
+        parentdir, xmllist = release_xmls(tmp_path, name)
+        for xml_file in xmllist:
+            update_xml(xml_file, {'child_id': 'page1'}, plan=p)
+        contents.append([open(x, 'rb').read() for x in xmllist])
+    assert contents[0] == contents[1]
+    assert b'<abstract>New</abstract>' in contents[0][0]
+
+def test_update_all_xmls_in_processes_matches_sequential(tmp_path):
+    contents = []
+    for max_processes in (1, 2):
+        parentdir, xmllist = release_xmls(tmp_path, str(max_processes))
+        extents = {}
+        results = update_all_xmls(parentdir, new_values, verbose=False, extents=extents, max_processes=max_processes)
+        assert [r['xml_file'] for r in results] == glob.glob(os.path.join(parentdir, '**/*.xml'), recursive=True)
+        assert not any(r['error'] for r in results)
+        assert len(extents) == len(results)
+        contents.append([open(r['xml_file'], 'rb').read() for r in results])
+    assert contents[0] == contents[1]
+
+def test_update_all_xmls_rerun_leaves_files_untouched(tmp_path):
+    parentdir, xmllist = release_xmls(tmp_path)
+    results = update_all_xmls(parentdir, new_values, verbose=False)
+    assert results and all(r['changed'] and not r['error'] for r in results)
+    mtimes = {xml_file: os.stat(xml_file).st_mtime_ns for xml_file in xmllist}
+    results = update_all_xmls(parentdir, new_values, verbose=False)
+    assert not any(r['changed'] for r in results)
+    assert mtimes == {xml_file: os.stat(xml_file).st_mtime_ns for xml_file in xmllist}
+    # A new value is written, along with the metadata date
+    results = update_all_xmls(parentdir, dict(new_values, pubdate='2020'), verbose=False)
+    assert all(r['changed'] for r in results)
+
+def test_metadata_date_is_left_alone_when_nothing_else_changes(tmp_path):
+    parentdir, xmllist = release_xmls(tmp_path)
+    update_all_xmls(parentdir, new_values, verbose=False)
+    replace_in_file(xmllist[0], '<metd>[0-9]*</metd>', '<metd>20180101</metd>')
+    results = update_all_xmls(parentdir, new_values, verbose=False)
+    assert not any(r['changed'] for r in results)
+    assert etree.parse(xmllist[0]).getroot().findtext('./metainfo/metd') == '20180101'
+
+def test_rerun_with_additions_and_replacements_leaves_files_untouched(tmp_path):
+    parentdir, xmllist = release_xmls(tmp_path)
+    crossref = """
+        <crossref><citeinfo>
+            <origin>Author</origin>
+            <pubdate>2017</pubdate>
+            <title>Earlier report</title>
+            <onlink>https://doi.org/10.3133/ofr20171015</onlink>
+        </citeinfo></crossref>
+        """
+    values = dict(new_values, metadata_additions={'./idinfo': crossref},
+                  metadata_replacements={'./idinfo/citation/citeinfo': '<title>New title</title>'})
+    update_all_xmls(parentdir, values, verbose=False)
+    mtimes = {xml_file: os.stat(xml_file).st_mtime_ns for xml_file in xmllist}
+    results = update_all_xmls(parentdir, values, verbose=False)
+    assert not any(r['changed'] for r in results)
+    assert mtimes == {xml_file: os.stat(xml_file).st_mtime_ns for xml_file in xmllist}
+    root = etree.parse(xmllist[0]).getroot()
+    assert len(root.findall('./idinfo/crossref')) == 1
+    assert root.findtext('./idinfo/citation/citeinfo/title') == 'New title'